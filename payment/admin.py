@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from . import models
+from .routers import replica_reads
 
 
 @admin.register(models.PayPortal)
@@ -8,9 +9,17 @@ class PayPortalAdmin(admin.ModelAdmin):
     list_display = ["name", "code_name", 'backend']
 
 
+class TransactionDetailInline(admin.StackedInline):
+    """
+    Cold fields of transaction in split layout
+    """
+    model = models.TransactionDetail
+    can_delete = False
+
+
 @admin.register(models.Transaction)
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ["user", "amount", "create_date", "status", 'shaparak_tracking_code']
+    list_display = ["user", "amount", "create_date", "status", 'tracking_code']
     search_fields = ["user__username", "user__first_name", "user__last_name", "amount", "create_date",
                      "status", 'shaparak_tracking_code', 'description']
     list_filter = [
@@ -19,3 +28,33 @@ class TransactionAdmin(admin.ModelAdmin):
     ]
     date_hierarchy = 'create_date'
     show_facets = admin.ShowFacets.ALWAYS
+
+    @admin.display(description=models.TransactionDetail._meta.get_field('shaparak_tracking_code').verbose_name)
+    def tracking_code(self, obj):
+        # Cold fields are in TransactionDetail in split layout
+        return obj.cold.shaparak_tracking_code
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_cold_fields()
+
+    def get_search_fields(self, request):
+        if not models.is_split_layout():
+            return self.search_fields
+        return [f'detail__{field}' if field in models.COLD_FIELDS else field for field in self.search_fields]
+
+    def get_exclude(self, request, obj=None):
+        if not models.is_split_layout():
+            return super().get_exclude(request, obj)
+        return [*(super().get_exclude(request, obj) or ()), *models.COLD_FIELDS]
+
+    def get_inlines(self, request, obj):
+        if not models.is_split_layout():
+            return super().get_inlines(request, obj)
+        return [*super().get_inlines(request, obj), TransactionDetailInline]
+
+    def changelist_view(self, request, extra_context=None):
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
@@ -1,9 +1,9 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.module_loading import autodiscover_modules
 from django.utils.translation import gettext_lazy as _
 
-from payment.registry import registry
+from payment.registry import linked_registry, registry
 
 
 class PaymentConfig(AppConfig):
@@ -12,11 +12,22 @@ class PaymentConfig(AppConfig):
     verbose_name = _('Payment')
 
     def ready(self):
-        from .models import Transaction
-        from .signals import update_last_transaction_id
+        from .models import PayPortal, RefundBatch, Transaction
+        from .sharding import replicate_row
+        from .signals import post_transition, post_transition_batch, update_last_transaction_id
+        from .summary import (remember_status, update_summary_on_delete, update_summary_on_save,
+                              update_summary_on_transition, update_summary_on_transition_batch)
 
         autodiscover()
+        linked_registry.autodiscover()
         post_save.connect(update_last_transaction_id, sender=Transaction)
+        post_save.connect(replicate_row, sender=PayPortal)
+        post_save.connect(replicate_row, sender=RefundBatch)
+        pre_save.connect(remember_status, sender=Transaction)
+        post_save.connect(update_summary_on_save, sender=Transaction)
+        post_delete.connect(update_summary_on_delete, sender=Transaction)
+        post_transition.batched.connect(update_summary_on_transition, sender=Transaction)
+        post_transition_batch.connect(update_summary_on_transition_batch, sender=Transaction)
 
 
 def autodiscover():
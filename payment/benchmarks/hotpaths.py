@@ -0,0 +1,275 @@
+"""
+Time, allocations and exact query counts of payment hot paths, compared with stored baselines
+Run by ``manage.py benchmark_hot_paths`` on a temporary test database, Pay portal responses are served in process by
+payment.payment_backends.traffic.ReplayTransport so no request leaves the process
+
+Each operation is a factory that prepares one run (untimed) and returns the callable that is measured
+"""
+import json
+import os
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test import override_settings
+from requests import Response
+
+from payment.models import PayPortal, Transaction
+from payment.payment_apis.checkout import CREATE_QUERY_BUDGET
+from payment.payment_backends.traffic import ReplayTransport, get_backend_path, replay
+from payment.payment_backends.zibal import ZibalBackend
+from payment.profiling import count_queries
+from payment.registry import linked_registry, registry
+from payment.status import StatusChoices
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# (relative, absolute) growth allowed before a run fails, Query counts must not grow at all
+TOLERANCES = {
+    'time': (0.5, 20e-6),
+    'allocations': (0.25, 1024),
+}
+
+# Transactions of user of list API
+LIST_SIZE = 20
+
+CREATE_DATA = {'portal': 'benchmark', 'amount': 10000, 'callback_url': 'https://example.com/callback/'}
+CREATE_RESPONSE = {'result': 100, 'trackId': 1000}
+VERIFY_RESPONSE = {'result': 100, 'status': 1, 'refNumber': '123456789012', 'cardNumber': '6037-****-****-1234'}
+
+# Operations that regress are measured again before failing, A busy machine slows down a whole measurement
+RETRIES = 2
+
+OPERATIONS = {}
+# Operations that must not run more queries than their budget, Whatever their baseline is
+QUERY_BUDGETS = {}
+
+
+def operation(name, query_budget=None):
+    def decorator(factory):
+        OPERATIONS[name] = factory
+        if query_budget is not None:
+            QUERY_BUDGETS[name] = query_budget
+        return factory
+    return decorator
+
+
+class Environment:
+    """
+    Database rows and stub transport shared by operations
+    """
+
+    def __init__(self):
+        backend = get_backend_path(ZibalBackend)
+        self.portal, _ = PayPortal.objects.get_or_create(code_name='benchmark', defaults={
+            'name': 'Benchmark', 'backend': backend, 'api_key': 'benchmark', 'order_id_prefix': 'benchmark'
+        })
+        self.user, _ = get_user_model().objects.get_or_create(username='payment-benchmark')
+        self.list_user, _ = get_user_model().objects.get_or_create(username='payment-benchmark-list')
+        self.transport = ReplayTransport([
+            {'backend': backend, 'phase': 'CREATE', 'status': 200, 'response': CREATE_RESPONSE, 'latency': 0},
+            {'backend': backend, 'phase': 'VERIFY', 'status': 200, 'response': VERIFY_RESPONSE, 'latency': 0},
+        ], speed=None)
+        self.counter = 0
+        for _ in range(LIST_SIZE):
+            self.saved_transaction(StatusChoices.SUCCESSFUL, user=self.list_user)
+
+    def new_transaction(self, **kwargs):
+        self.counter += 1
+        return Transaction(portal=self.portal, amount=10000, **{'user': self.user, **kwargs})
+
+    def saved_transaction(self, status=StatusChoices.WAIT_FOR_PAY, **kwargs):
+        transaction = self.new_transaction(status=status, transaction_id=f"benchmark-saved-{self.counter}", **kwargs)
+        transaction.locate_id()
+        transaction.save(force_insert=True)
+        return transaction
+
+    @staticmethod
+    def response(data):
+        response = Response()
+        response.status_code = 200
+        response._content = json.dumps(data).encode()
+        return response
+
+
+@operation('backend.get_create_context')
+def get_create_context(env):
+    backend = env.new_transaction().backend_controller
+    return backend.get_create_context
+
+
+@operation('backend.apply_to_transaction')
+def apply_to_transaction(env):
+    backend = env.new_transaction().backend_controller
+    return lambda: backend.apply_to_transaction(VERIFY_RESPONSE)
+
+
+@operation('backend.handle_create')
+def handle_create(env):
+    transaction = env.new_transaction()
+    transaction.locate_id()
+    response = env.response({**CREATE_RESPONSE, 'trackId': f"benchmark-{env.counter}"})
+    return lambda: transaction.backend_controller.handle_create(response)
+
+
+@operation('backend.handle_verify')
+def handle_verify(env):
+    backend = env.saved_transaction().backend_controller
+    response = env.response(VERIFY_RESPONSE)
+    return lambda: backend.handle_verify(response)
+
+
+@operation('transaction.create')
+def create(env):
+    transaction = env.new_transaction()
+    return lambda: transaction.create('https://example.com/callback/')
+
+
+@operation('transaction.verify')
+def verify(env):
+    return env.saved_transaction().verify
+
+
+@operation('transaction.locate_id')
+def locate_id(env):
+    return env.new_transaction().locate_id
+
+
+@operation('registry.get_backend')
+def get_backend(env):
+    name = env.portal.backend
+    return lambda: registry.get_backend(name)
+
+
+@operation('registry.get_handler')
+def get_handler(env):
+    transaction = env.new_transaction(linked_contenttype=ContentType.objects.get_for_model(get_user_model()))
+    return lambda: linked_registry.get_handler(transaction, 'successful')
+
+
+def _view(env, actions, user, method='get', path='/', detail=False, data=None, headers=None):
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from payment.payment_apis.api.v1.views import TransactionViewSet
+
+    kwargs = {}
+    if detail:
+        kwargs['pk'] = env.saved_transaction(StatusChoices.SUCCESSFUL).pk
+    request = getattr(APIRequestFactory(), method)(path, data, format='json', headers=headers)
+    force_authenticate(request, user=user)
+    view = TransactionViewSet.as_view(actions)
+
+    def run():
+        response = view(request, **kwargs)
+        response.render()
+        return response
+    return run
+
+
+@operation('api.list')
+def api_list(env):
+    return _view(env, {'get': 'list'}, env.list_user)
+
+
+@operation('api.retrieve')
+def api_retrieve(env):
+    return _view(env, {'get': 'retrieve'}, env.user, detail=True)
+
+
+@operation('api.verify')
+def api_verify(env):
+    return _view(env, {'get': 'verify'}, env.user, detail=True)
+
+
+@operation('api.create', query_budget=CREATE_QUERY_BUDGET)
+def api_create(env):
+    return _view(env, {'post': 'create'}, env.user, method='post', data=CREATE_DATA)
+
+
+@operation('api.create_idempotent', query_budget=CREATE_QUERY_BUDGET)
+def api_create_idempotent(env):
+    # New key each run, Measures the cache miss path
+    env.counter += 1
+    return _view(env, {'post': 'create'}, env.user, method='post', data=CREATE_DATA,
+                 headers={'Idempotency-Key': f"benchmark-{env.counter}"})
+
+
+def measure(env, factory, repeat):
+    """
+    Return seconds of fastest run (least disturbed by noise), peak allocated bytes and queries of the most expensive
+    run
+    """
+    factory(env)()  # Warm up caches and lazy imports
+    times = []
+    queries = 0
+    for _ in range(repeat):
+        run = factory(env)
+        with count_queries() as counter:
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+        queries = max(queries, counter.count)
+    run = factory(env)
+    tracemalloc.start()
+    try:
+        run()
+        allocations = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': min(times), 'allocations': allocations, 'queries': queries}
+
+
+def load_baselines(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baselines(results, path=BASELINE_PATH):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=4, sort_keys=True)
+        file.write('\n')
+
+
+def compare(name, result, baseline):
+    """
+    Return regressions of result against baseline, Metrics missing from baseline are not compared
+    """
+    regressions = []
+    if name in QUERY_BUDGETS and result['queries'] > QUERY_BUDGETS[name]:
+        regressions.append(f"{name}: {result['queries']} queries, Budget is {QUERY_BUDGETS[name]}")
+    if 'queries' in baseline and result['queries'] > baseline['queries']:
+        regressions.append(f"{name}: {result['queries']} queries, baseline is {baseline['queries']}")
+    for metric, (relative, absolute) in TOLERANCES.items():
+        if metric in baseline and result[metric] > baseline[metric] * (1 + relative) + absolute:
+            regressions.append(f"{name}: {metric} {result[metric]:.6g}, baseline is {baseline[metric]:.6g} "
+                               f"(+{relative:.0%} allowed)")
+    return regressions
+
+
+def run(repeat=50, only=None, baselines=None, stdout=None):
+    """
+    Measure operations and return (results, regressions)
+    """
+    baselines = {} if baselines is None else baselines
+    results = {}
+    regressions = []
+    # Settings that add work to hot paths are turned off so results are comparable between projects
+    with override_settings(PAYMENT_HEDGE_VERIFY=False, PAYMENT_PROFILE_SAMPLE_RATE=0,
+                           PAYMENT_TRAFFIC_RECORD_PATH=None, PAYMENT_TRANSACTION_LAYOUT='inline', PAYMENT_SHARDS=[]):
+        env = Environment()
+        with replay(env.transport):
+            for name, factory in OPERATIONS.items():
+                if only and not name.startswith(only):
+                    continue
+                for _ in range(RETRIES + 1):
+                    results[name] = result = measure(env, factory, repeat)
+                    if not (operation_regressions := compare(name, result, baselines.get(name, {}))):
+                        break
+                regressions.extend(operation_regressions)
+                if stdout is not None:
+                    stdout.write(f"{name:<32} {result['time'] * 1e6:10.1f} us {result['allocations']:10d} B "
+                                 f"{result['queries']:4d} queries")
+    return results, regressions
@@ -0,0 +1,80 @@
+"""
+Compare row width and status update throughput of inline and split transaction layouts
+Run by ``manage.py benchmark_transaction_layout`` on a temporary test database
+"""
+import io
+import time
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+
+from payment.models import COLD_FIELDS, PayPortal, Transaction
+from payment.state_machine import PENDING_STATUSES
+from payment.status import StatusChoices
+
+
+def populate(count):
+    portal, _ = PayPortal.objects.get_or_create(code_name='benchmark', defaults={
+        'name': 'Benchmark', 'backend': 'payment.payment_backends.zibal.ZibalBackend', 'api_key': 'benchmark',
+        'order_id_prefix': 'benchmark'
+    })
+    Transaction.objects.bulk_create(
+        Transaction(portal=portal, transaction_id=f"benchmark-{index}", amount=10000, status=StatusChoices.WAIT_FOR_PAY,
+                    card_holder='6037-****-****-1234', shaparak_tracking_code='123456789012',
+                    description="Payment of order with several items " * 20,
+                    other={'items': [{'id': item, 'title': f"Item {item}", 'price': 10000} for item in range(20)]})
+        for index in range(count)
+    )
+
+
+def row_width():
+    """
+    Average stored width of transaction rows in bytes
+    """
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"SELECT AVG(pg_column_size(t.*)) FROM {table} t")
+            return float(cursor.fetchone()[0])
+        width = ' + '.join(f"COALESCE(LENGTH(CAST({connection.ops.quote_name(field.column)} AS TEXT)), 0)"
+                            for field in Transaction._meta.concrete_fields)
+        cursor.execute(f"SELECT AVG({width}) FROM {table}")
+        return float(cursor.fetchone()[0])
+
+
+def update_throughput():
+    """
+    Conditional status updates per second (Like state_machine.transition of verify)
+    """
+    pks = list(Transaction.objects.values_list('pk', flat=True))
+    started = time.perf_counter()
+    for pk in pks:
+        Transaction.objects.filter(pk=pk, status__in=PENDING_STATUSES).update(status=StatusChoices.WAIT_FOR_BANK)
+    elapsed = time.perf_counter() - started
+    Transaction.objects.update(status=StatusChoices.WAIT_FOR_PAY)
+    return len(pks) / elapsed
+
+
+def pending_scan():
+    """
+    Seconds of scanning hot fields of pending transactions
+    """
+    started = time.perf_counter()
+    list(Transaction.objects.pending().values_list('pk', 'transaction_id', 'amount', 'status', 'last_verify'))
+    return time.perf_counter() - started
+
+
+def run(count=10000, stdout=None):
+    populate(count)
+    results = {}
+    results['inline'] = (row_width(), update_throughput(), pending_scan())
+    with override_settings(PAYMENT_TRANSACTION_LAYOUT='split'):
+        call_command('split_transaction_details', batch_size=1000, stdout=io.StringIO())
+        results['split'] = (row_width(), update_throughput(), pending_scan())
+    if stdout is not None:
+        stdout.write(f"{count} transactions, cold fields: {', '.join(COLD_FIELDS)}")
+        for layout, (width, throughput, scan) in results.items():
+            stdout.write(f"{layout:>8}: row width {width:8.1f} B | {throughput:10.1f} updates/s | "
+                         f"pending scan {scan * 1000:8.1f} ms")
+    return results
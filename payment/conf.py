@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+
+__all__ = ['DEFAULTS', 'get_setting', 'get_cache']
+
+# Every setting is read from django settings with ``PAYMENT_`` prefix, e.g. ``PAYMENT_VERIFY_BACKOFF_BASE``
+DEFAULTS = {
+    # Verify scheduler
+    'VERIFY_BACKOFF_BASE': timedelta(seconds=30),
+    'VERIFY_BACKOFF_MAX': timedelta(hours=1),
+    'VERIFY_BACKOFF_JITTER': 0.1,
+    'VERIFY_EXPIRY': timedelta(days=1),
+    'VERIFY_WORKER_BATCH_SIZE': 100,
+    'VERIFY_WORKER_RATE': 10.0,
+    'VERIFY_WORKER_LEASE': timedelta(minutes=5),
+    'VERIFY_WORKER_IDLE_SLEEP': 5.0,
+    # Cache alias used by payment for shared state, must be shared between processes in production
+    'CACHE': 'default',
+    # Database routing (payment.routers.PaymentRouter)
+    'PRIMARY_DATABASE': 'default',
+    'REPLICA_DATABASES': [],
+    'PIN_SECONDS': 5,
+    # Serialized transaction cache of payment_apis
+    'REPRESENTATION_CACHE_TIMEOUT': 300,
+    # Status push of payment_apis (payment.payment_apis.broker)
+    'EVENT_BROKER': 'payment.payment_apis.broker.LocalBroker',
+    'EVENT_BROKER_POLL_INTERVAL': 0.5,
+    'EVENT_WAIT_TIMEOUT': 25,
+    'EVENT_STREAM_MAX_DURATION': 300,
+    # Idempotent transaction creation (payment.idempotency)
+    'IDEMPOTENCY_CACHE_TIMEOUT': 60 * 60 * 24,
+    'IDEMPOTENCY_LOCK_TIMEOUT': 30,
+    # Transaction event log (payment.events)
+    'EVENT_RETENTION_DAYS': 365,
+    # 'inline' keeps cold fields on Transaction and 'split' moves them to TransactionDetail
+    'TRANSACTION_LAYOUT': 'inline',
+    # Gateway requests (timeouts in seconds)
+    'REQUEST_TIMEOUT': 30,
+    'API_DEADLINE': 15,
+    'HEDGE_VERIFY': False,
+    'HEDGE_PERCENTILE': 95,
+    'HEDGE_MIN_SAMPLES': 50,
+    'HEDGE_DEFAULT_DELAY': 1.0,
+    'HEDGE_MAX_WORKERS': 32,
+    # Sharding (payment.sharding.ShardRouter), Empty SHARDS means not sharded
+    'SHARDS': [],
+    'SHARD_KEY': 'user',
+    'DIRECTORY_DATABASE': 'default',
+    # Refund engine (payment.refunds)
+    'REFUND_PORTAL_CONCURRENCY': 4,
+    'REFUND_CHUNK_SIZE': 200,
+    # Profiling (payment.profiling), Off unless sample rate is set or request has X-Payment-Profile: <PROFILE_TOKEN>
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_TOKEN': None,
+    'PROFILE_SINK': 'payment.profiling.FileSink',
+    'PROFILE_DIRECTORY': None,
+    'PROFILE_TRACEMALLOC': False,
+    # Create API (payment.payment_apis.checkout)
+    'PORTAL_CACHE_TIMEOUT': 300,
+    'CHECKOUT_ASYNC_WORKERS': 8,
+    # Traffic capture (payment.payment_backends.traffic), Recording is off while path is None
+    'TRAFFIC_RECORD_PATH': None,
+    'TRAFFIC_REDACT_KEYS': ['merchant', 'api', 'api_key', 'apiKey', 'token', 'cardNumber', 'card_number',
+                            'card_holder', 'mobile', 'email', 'nationalCode'],
+}
+
+
+def get_setting(name):
+    return getattr(settings, f'PAYMENT_{name}', DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting('CACHE')]
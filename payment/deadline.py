@@ -0,0 +1,44 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from payment.exceptions import DeadlineExceeded
+
+__all__ = ['deadline', 'remaining', 'check_deadline']
+
+_deadline = ContextVar('payment_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Run block with a deadline, Every gateway request inside it uses remaining time as its timeout
+    Nested deadline never extends outer one
+    """
+    if seconds is None:
+        yield
+        return
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new_deadline if current is None else min(current, new_deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Return seconds remaining to deadline or None when there is no deadline
+    """
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Deadline of request exceeded")
+    return left
@@ -1,8 +1,12 @@
 from payment.payment_backends import BaseBackend
+from payment.payment_backends.spec import BackendSpec
 from payment.registry import registry
 
 
 def register(backend_class):
+    if isinstance(backend_class, BackendSpec):
+        return registry.register_spec(backend_class)
+
     if not issubclass(backend_class, BaseBackend):
         # Create a subclass of backend_class that inherits from BasePayPortalBackend
         merged_class = type(backend_class.__name__, (BaseBackend, backend_class), {})
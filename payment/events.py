@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+__all__ = ['buffer_events', 'record_event', 'flush_events']
+
+_buffer = ContextVar('payment_event_buffer', default=None)
+
+
+@contextmanager
+def buffer_events():
+    """
+    Keep events recorded in this block and write them with one bulk_create at the end
+    Used per request by TransactionEventMiddleware and per batch by workers
+    """
+    if _buffer.get() is not None:
+        # Nested block is flushed by outer one
+        yield _buffer.get()
+        return
+    events = []
+    token = _buffer.set(events)
+    try:
+        yield events
+    finally:
+        _buffer.reset(token)
+        flush_events(events)
+
+
+def record_event(transaction, phase, code=None, status=None, http_status=None, latency=0, order_id=None):
+    """
+    transaction is a Transaction or its ID
+    Events of failed creates are kept by ``order_id`` sent to pay portal without transaction, Their transaction is
+    not saved and its ID is located again for next transaction
+    """
+    from payment.models import TransactionEvent
+    from payment.sharding import is_sharded, shard_for_id
+
+    transaction_id = getattr(transaction, 'pk', transaction)
+    event = TransactionEvent(transaction_id=None if order_id else transaction_id, order_id=order_id, phase=phase,
+                             code=None if code is None else str(code)[:32], status=status, http_status=http_status,
+                             latency=int(latency))
+    # Event is written to shard of transaction ID, Also when it is kept without transaction
+    event._state.db = shard_for_id(transaction_id) if is_sharded() else None
+    events = _buffer.get()
+    if events is not None:
+        events.append(event)
+        return
+    # A single INSERT, bulk_create would wrap it in a transaction
+    event.save(force_insert=True, using=event._state.db)
+
+
+def flush_events(events):
+    from payment.models import TransactionEvent
+
+    if not events:
+        return
+    from payment.sharding import is_sharded
+
+    if is_sharded():
+        by_shard = {}
+        for event in events:
+            by_shard.setdefault(event._state.db, []).append(event)
+        for shard, shard_events in by_shard.items():
+            TransactionEvent.objects.using(shard).bulk_create(shard_events)
+    else:
+        TransactionEvent.objects.bulk_create(events)
+    events.clear()
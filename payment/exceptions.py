@@ -27,3 +27,13 @@ class AlreadyRegistered(Exception):
 
 class NotRegistered(Exception):
     pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    Idempotency key of user is already used by a transaction of other portal, amount or callback URL
+    """
@@ -0,0 +1,116 @@
+import hashlib
+import time
+
+from django.db import IntegrityError, router, transaction as db_transaction
+
+from payment.conf import get_cache, get_setting
+from payment.exceptions import IdempotencyKeyReused
+from payment.sharding import is_sharded, run_on_shards, shard_for_id, shard_for_key
+
+__all__ = ['get_transaction_by_key', 'get_fingerprint', 'create_idempotent']
+
+
+def _cache_key(user_id, idempotency_key):
+    return f"payment:idempotency:{user_id}:{idempotency_key}"
+
+
+def get_transaction_by_key(user_id, idempotency_key, cached_only=False):
+    """
+    Return transaction of user with idempotency key, Look up cache first and then database (unless cached_only)
+    """
+    from payment.models import Transaction
+
+    cache = get_cache()
+    queryset = Transaction.objects.select_related('portal')
+    if pk := cache.get(_cache_key(user_id, idempotency_key)):
+        # Order ID knows its shard
+        if transaction := (queryset.using(shard_for_id(pk)) if is_sharded() else queryset).filter(pk=pk).first():
+            return transaction
+    if cached_only:
+        return None
+    queryset = queryset.filter(user_id=user_id, idempotency_key=idempotency_key)
+    if not is_sharded():
+        transaction = queryset.first()
+    elif get_setting('SHARD_KEY') == 'user':
+        transaction = queryset.using(shard_for_key(user_id)).first()
+    else:
+        # Transactions of user are on every shard
+        transaction = next(filter(None, run_on_shards(lambda shard: queryset.using(shard).first()).values()), None)
+    if transaction is not None:
+        cache.set(_cache_key(user_id, idempotency_key), transaction.pk,
+                  timeout=get_setting('IDEMPOTENCY_CACHE_TIMEOUT'))
+    return transaction
+
+
+def get_fingerprint(transaction, callback_uri):
+    """
+    Hash of request that creates transaction, A key must not be reused for other portal, amount or callback URL
+    """
+    return hashlib.sha256(f"{transaction.portal_id}:{transaction.amount}:{callback_uri}".encode()).hexdigest()
+
+
+def _reuse(existing, transaction, fingerprint):
+    """
+    Return (existing, False) when it was created by same request, Otherwise raise IdempotencyKeyReused
+    """
+    if existing.idempotency_fingerprint is None:
+        # Created before fingerprints were stored
+        same = (existing.portal_id, existing.amount) == (transaction.portal_id, transaction.amount)
+    else:
+        same = existing.idempotency_fingerprint == fingerprint
+    if not same:
+        raise IdempotencyKeyReused(f"Idempotency key {existing.idempotency_key!r} is used by another request")
+    return existing, False
+
+
+def create_idempotent(transaction, callback_uri, idempotency_key, **kwargs):
+    """
+    Create transaction on pay portal unless user already created one with this key
+    Concurrent calls with same key wait for the in-flight create and return its transaction
+    Reusing key with other portal, amount or callback URL raises IdempotencyKeyReused
+
+    Return (transaction, created), When pay portal doesn't accept request, return (transaction, False) and
+    transaction is not saved
+    """
+    from payment.models import Transaction
+
+    user_id = transaction.user_id
+    if user_id is None:
+        # Unique constraint of keys doesn't cover transactions without user
+        raise ValueError("Idempotency key needs user of transaction")
+    fingerprint = get_fingerprint(transaction, callback_uri)
+    cache = get_cache()
+    lock_key = _cache_key(user_id, idempotency_key) + ":lock"
+    lock_timeout = get_setting('IDEMPOTENCY_LOCK_TIMEOUT')
+    deadline = time.monotonic() + lock_timeout
+
+    while True:
+        if existing := get_transaction_by_key(user_id, idempotency_key):
+            return _reuse(existing, transaction, fingerprint)
+        if cache.add(lock_key, True, timeout=lock_timeout):
+            break
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Creating transaction with idempotency key {idempotency_key!r} is in progress")
+        time.sleep(0.1)
+
+    try:
+        # Lock may be taken after the other create finished, It cached its transaction and unique constraint catches
+        # the rest
+        if existing := get_transaction_by_key(user_id, idempotency_key, cached_only=True):
+            return _reuse(existing, transaction, fingerprint)
+        transaction.idempotency_key = idempotency_key
+        transaction.idempotency_fingerprint = fingerprint
+        try:
+            # Savepoint keeps transaction of request (ATOMIC_REQUESTS) usable after a duplicate key
+            with db_transaction.atomic(using=router.db_for_write(Transaction, instance=transaction)):
+                created = transaction.create(callback_uri, **kwargs)
+        except IntegrityError:
+            if existing := get_transaction_by_key(user_id, idempotency_key):
+                return _reuse(existing, transaction, fingerprint)
+            raise
+        if created:
+            cache.set(_cache_key(user_id, idempotency_key), transaction.pk,
+                      timeout=get_setting('IDEMPOTENCY_CACHE_TIMEOUT'))
+        return transaction, created
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from payment.benchmarks import hotpaths
+
+
+class Command(BaseCommand):
+    help = "Measure time, allocations and queries of payment hot paths on a test database and compare with baselines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--only', help="Only operations that their name starts with it, e.g. api.")
+        parser.add_argument('--baselines', default=hotpaths.BASELINE_PATH)
+        parser.add_argument('--update-baselines', action='store_true',
+                            help="Write results as baselines, Include time and allocations of this machine")
+
+    def handle(self, *args, **options):
+        baselines = hotpaths.load_baselines(options['baselines'])
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results, regressions = hotpaths.run(options['repeat'], options['only'], baselines, self.stdout)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        if options['update_baselines']:
+            hotpaths.save_baselines({**baselines, **results}, options['baselines'])
+            self.stdout.write(f"Baselines written to {options['baselines']}")
+            return
+        if regressions:
+            raise CommandError("Regressions against baselines:\n" + '\n'.join(regressions))
+        self.stdout.write("No regression")
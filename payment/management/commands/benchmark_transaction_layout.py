@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from payment.benchmarks import layout
+
+
+class Command(BaseCommand):
+    help = "Benchmark row width and update throughput of inline and split transaction layouts on a test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            layout.run(options['count'], self.stdout)
+        finally:
+            teardown_databases(old_config, verbosity=0)
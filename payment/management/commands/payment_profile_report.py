@@ -0,0 +1,59 @@
+import io
+import pstats
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from payment.profiling import get_sink
+
+
+class Command(BaseCommand):
+    help = "Aggregate profiles captured by payment.profiling into a hot function report"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name',
+                            help="Only profiles that their name starts with it, e.g. TransactionViewSet.verify")
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'])
+        parser.add_argument('--limit', type=int, default=30)
+
+    def handle(self, *args, **options):
+        profiles = [profile for profile in get_sink().read()
+                    if not options['name'] or profile.name.startswith(options['name'])]
+        if not profiles:
+            self.stdout.write("No profile captured")
+            return
+
+        durations = defaultdict(list)
+        timings = defaultdict(lambda: [0, 0.0])
+        slow_queries = []
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream)
+        for profile in profiles:
+            durations[profile.name].append(profile.duration)
+            for key, (count, seconds) in profile.timings.items():
+                timings[key][0] += count
+                timings[key][1] += seconds
+            slow_queries.extend(profile.slow_queries)
+            if profile.stats:
+                stats.add(pstats.Stats(profile))
+
+        self.stdout.write(f"{len(profiles)} profiles\n")
+        self.stdout.write(f"{'name':<50} {'count':>7} {'mean ms':>10} {'p95 ms':>10}")
+        for name, values in sorted(durations.items()):
+            values.sort()
+            self.stdout.write(f"{name:<50} {len(values):>7} {sum(values) / len(values) * 1000:>10.1f} "
+                              f"{values[int(len(values) * 0.95)] * 1000:>10.1f}")
+
+        self.stdout.write(f"\n{'timing':<70} {'count':>7} {'total ms':>10} {'ms/profile':>10}")
+        for key, (count, seconds) in sorted(timings.items(), key=lambda item: item[1][1], reverse=True):
+            self.stdout.write(f"{key[:70]:<70} {count:>7} {seconds * 1000:>10.1f} "
+                              f"{seconds * 1000 / len(profiles):>10.2f}")
+
+        self.stdout.write("\nSlowest queries")
+        for duration, sql in sorted(slow_queries, reverse=True)[:10]:
+            self.stdout.write(f"{duration * 1000:>10.1f}ms {sql[:200]}")
+
+        if stats.stats:
+            self.stdout.write("\nHot functions")
+            stats.sort_stats(options['sort']).print_stats(options['limit'])
+            self.stdout.write(stream.getvalue())
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payment.models import RefundBatch
+from payment.refunds import RefundProcessor
+
+
+class Command(BaseCommand):
+    help = "Execute pending refunds of a refund batch, Run again to resume an interrupted batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_id', type=int)
+        parser.add_argument('--concurrency', type=int, help="Concurrent refund requests of each pay portal")
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--dry-run', action='store_true', help="Report refunds without sending any request")
+        parser.add_argument('--retry-in-flight', action='store_true',
+                            help="Retry refunds that an interrupted run sent but didn't record "
+                                 "(They may be refunded already)")
+
+    def handle(self, *args, **options):
+        try:
+            batch = RefundBatch.objects.get(pk=options['batch_id'])
+        except RefundBatch.DoesNotExist:
+            raise CommandError(f"Refund batch {options['batch_id']} does not exist")
+        processor = RefundProcessor(batch, portal_concurrency=options['concurrency'],
+                                    chunk_size=options['chunk_size'], dry_run=options['dry_run'],
+                                    progress=lambda progress: self.stdout.write(str(progress)))
+        if options['retry_in_flight'] and not options['dry_run']:
+            self.stdout.write(f"{processor.retry_in_flight()} in-flight refunds queued again")
+        progress = processor.run()
+        self.stdout.write(f"Done: {progress}, {progress.amount} refunded in {progress.elapsed:.1f}s")
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from payment.conf import get_setting
+from payment.models import TransactionEvent
+from payment.sharding import get_transaction_databases, run_on_shards
+
+
+class Command(BaseCommand):
+    help = "Delete old transaction events and compact repeated ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Delete events older than this number of days "
+                                                     "(settings.PAYMENT_EVENT_RETENTION_DAYS by default)")
+        parser.add_argument('--compact-days', type=int,
+                            help="Also delete repeated events (same phase, code and status as previous event of "
+                                 "transaction or order) older than this number of days")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--database', help="Database of events, Every shard in parallel by default when "
+                                               "transactions are sharded")
+
+    def handle(self, *args, **options):
+        databases = get_transaction_databases(options['database'])
+        results = run_on_shards(lambda database: self.prune(database, options['days'], options['compact_days'],
+                                                            options['batch_size']), databases)
+        for database, (deleted, compacted) in results.items():
+            self.stdout.write(f"{database}: {deleted} expired events deleted")
+            if compacted is not None:
+                self.stdout.write(f"{database}: {compacted} repeated events deleted")
+
+    def prune(self, database, days, compact_days, batch_size):
+        days = days or get_setting('EVENT_RETENTION_DAYS')
+        queryset = TransactionEvent.objects.using(database)
+        deleted = self.delete_in_batches(
+            queryset, queryset.filter(created_at__lt=now() - timedelta(days=days)).values_list('pk', flat=True),
+            batch_size
+        )
+        compacted = None
+        if compact_days is not None:
+            compacted = self.compact(queryset, now() - timedelta(days=compact_days), batch_size)
+        return deleted, compacted
+
+    @staticmethod
+    def delete_in_batches(queryset, pk_queryset, batch_size):
+        deleted = 0
+        while pks := list(pk_queryset[:batch_size]):
+            queryset.filter(pk__in=pks).delete()
+            deleted += len(pks)
+        return deleted
+
+    def compact(self, queryset, before, batch_size):
+        events = (queryset.filter(created_at__lt=before)
+                  .order_by('transaction_id', 'order_id', 'created_at', 'id')
+                  .values_list('pk', 'transaction_id', 'order_id', 'phase', 'code', 'status'))
+        repeated = []
+        deleted = 0
+        previous = None
+        for pk, *key in events.iterator(chunk_size=batch_size):
+            if key == previous:
+                repeated.append(pk)
+            previous = key
+            if len(repeated) >= batch_size:
+                deleted += self.delete_pks(queryset, repeated)
+        return deleted + self.delete_pks(queryset, repeated)
+
+    @staticmethod
+    def delete_pks(queryset, pks):
+        count = len(pks)
+        if pks:
+            queryset.filter(pk__in=pks).delete()
+            pks.clear()
+        return count
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from payment.refunds import queue_refunds
+from payment.sharding import get_transaction_databases
+
+
+class Command(BaseCommand):
+    help = "Queue refunds of transactions in a new refund batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('transaction_ids', nargs='*', type=int)
+        parser.add_argument('--file', help="File of transaction IDs, One ID in each line")
+        parser.add_argument('--amount', type=int, help="Amount of partial refund of each transaction")
+        parser.add_argument('--name', default='')
+
+    def handle(self, *args, **options):
+        ids = list(options['transaction_ids'])
+        if options['file']:
+            with open(options['file']) as file:
+                ids.extend(int(line) for line in file if line.strip())
+        batch = queue_refunds(ids, amount=options['amount'], name=options['name'])
+        count = sum(batch.refunds.using(database).count() for database in get_transaction_databases())
+        self.stdout.write(f"Batch {batch.pk}: {count} refunds queued")
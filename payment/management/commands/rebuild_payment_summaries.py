@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from payment.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute payment summaries of users from their transactions in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help="Only these users, Every user by default")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        queryset = get_user_model().objects.order_by('pk')
+        if options['user_ids']:
+            queryset = queryset.filter(pk__in=options['user_ids'])
+        last_pk = None
+        rebuilt = 0
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            user_ids = list(chunk.values_list('pk', flat=True)[:chunk_size])
+            if not user_ids:
+                break
+            rebuilt += rebuild_summaries(user_ids)
+            last_pk = user_ids[-1]
+            self.stdout.write(f"{rebuilt} summaries rebuilt")
@@ -0,0 +1,92 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from payment.exceptions import FailedPaymentError
+from payment.models import PayPortal, Transaction
+from payment.payment_backends.traffic import ReplayTransport, replay
+from payment.profiling import count_queries
+from payment.status import StatusChoices
+
+
+class Command(BaseCommand):
+    help = "Replay recorded pay portal traffic through full transaction lifecycle (create, verify, refund)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File recorded by PAYMENT_TRAFFIC_RECORD_PATH")
+        parser.add_argument('--portal', help="Code name of pay portal, First portal of recorded backend by default")
+        parser.add_argument('--count', type=int, help="Number of transactions, Recorded creates by default")
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help="Multiple of recorded speed, 0 serves responses without delay")
+        parser.add_argument('--amount', type=int, default=10000)
+        parser.add_argument('--callback-url', default='https://example.com/callback/')
+        parser.add_argument('--rollback', action='store_true', help="Roll back every write of replay")
+
+    def get_portal(self, transport, code_name):
+        if code_name:
+            try:
+                return PayPortal.objects.get(code_name=code_name)
+            except PayPortal.DoesNotExist:
+                raise CommandError(f"Pay portal {code_name} does not exist")
+        portal = PayPortal.objects.filter(backend__in=transport.get_backends()).first()
+        if portal is None:
+            raise CommandError("No pay portal uses a recorded backend, Pass --portal")
+        return portal
+
+    def handle(self, *args, **options):
+        transport = ReplayTransport.from_file(options['path'], speed=options['speed'] or None)
+        portal = self.get_portal(transport, options['portal'])
+        phases = transport.get_phases(portal.get_backend())
+        if 'CREATE' not in phases:
+            raise CommandError(f"No recorded create of {portal.backend}")
+        count = options['count'] or transport.count(portal.get_backend(), 'CREATE')
+        if count <= 0:
+            self.stdout.write("No transactions to replay")
+            return
+
+        timings = defaultdict(list)
+        statuses = Counter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            if options['rollback']:
+                stack.enter_context(db_transaction.atomic())
+            stack.enter_context(replay(transport))
+            counter = stack.enter_context(count_queries())
+            for _ in range(count):
+                obj = Transaction(portal=portal, amount=options['amount'])
+                try:
+                    created = self.timed(timings, 'create', obj.create, options['callback_url'])
+                except FailedPaymentError as e:
+                    statuses[StatusChoices(e.status).label] += 1
+                    continue
+                if created and 'VERIFY' in phases:
+                    self.timed(timings, 'verify', obj.verify)
+                if obj.status == StatusChoices.SUCCESSFUL and 'REFUND' in phases:
+                    self.timed(timings, 'refund', obj.refund)
+                statuses[StatusChoices(obj.status).label if created else 'Create failed'] += 1
+            if options['rollback']:
+                db_transaction.set_rollback(True)
+        elapsed = time.perf_counter() - started
+
+        rate = count / elapsed if elapsed else 0.0
+        self.stdout.write(f"{count} transactions in {elapsed:.2f}s ({rate:.1f}/s), "
+                          f"{counter.count / count:.1f} queries per transaction")
+        for phase, values in timings.items():
+            if not values:
+                continue
+            values.sort()
+            self.stdout.write(f"{phase:<8} mean {sum(values) / len(values) * 1000:8.2f}ms "
+                              f"p95 {values[int(len(values) * 0.95)] * 1000:8.2f}ms")
+        for label, number in statuses.most_common():
+            self.stdout.write(f"{label}: {number}")
+
+    @staticmethod
+    def timed(timings, phase, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            timings[phase].append(time.perf_counter() - started)
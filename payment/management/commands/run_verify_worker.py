@@ -0,0 +1,37 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from payment.scheduler import VerifyScheduler
+from payment.sharding import get_transaction_databases, run_on_shards
+
+
+class Command(BaseCommand):
+    help = "Verify pending transactions continuously with adaptive backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Number of transactions claimed in each round")
+        parser.add_argument('--rate', type=float, help="Maximum verifies per second of this worker")
+        parser.add_argument('--database', help="Database of transactions, Every shard in parallel by default when "
+                                               "transactions are sharded")
+        parser.add_argument('--once', action='store_true', help="Verify one batch and exit")
+
+    def handle(self, *args, **options):
+        databases = get_transaction_databases(options['database'])
+        schedulers = {
+            database: VerifyScheduler(batch_size=options['batch_size'], rate=options['rate'], using=database)
+            for database in databases
+        }
+
+        if options['once']:
+            counts = run_on_shards(lambda database: schedulers[database].run_once(), databases)
+            self.stdout.write(f"{sum(counts.values())} transactions verified")
+            return
+
+        def stop(*args):
+            for scheduler in schedulers.values():
+                scheduler.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        run_on_shards(lambda database: schedulers[database].run(), databases)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from payment.models import COLD_FIELDS, Transaction, TransactionDetail, is_split_layout
+
+
+class Command(BaseCommand):
+    help = "Move cold fields of existing transactions to TransactionDetail in batches (split layout)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not is_split_layout():
+            raise CommandError("Set settings.PAYMENT_TRANSACTION_LAYOUT = 'split' before moving cold fields")
+        batch_size = options['batch_size']
+        queryset = Transaction.objects.filter(detail__isnull=True).only('pk', *COLD_FIELDS).order_by('pk')
+        cleared = {field: Transaction._meta.get_field(field).get_default() for field in COLD_FIELDS}
+        last_pk = 0
+        moved = 0
+        while batch := list(queryset.filter(pk__gt=last_pk)[:batch_size]):
+            with db_transaction.atomic():
+                TransactionDetail.objects.bulk_create([
+                    TransactionDetail(transaction_id=transaction.pk,
+                                      **{field: getattr(transaction, field) for field in COLD_FIELDS})
+                    for transaction in batch
+                ], ignore_conflicts=True)
+                # update() keeps last_edit, Representation of transaction is not changed
+                Transaction.objects.filter(pk__in=[transaction.pk for transaction in batch]).update(**cleared)
+            last_pk = batch[-1].pk
+            moved += len(batch)
+            self.stdout.write(f"{moved} transactions moved")
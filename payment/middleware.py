@@ -0,0 +1,14 @@
+from payment.events import buffer_events
+
+
+class TransactionEventMiddleware:
+    """
+    Write transaction events of each request with one query at the end of request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffer_events():
+            return self.get_response(request)
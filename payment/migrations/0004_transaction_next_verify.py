@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0003_remove_payportal_default_currency_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='next_verify',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Next verify'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='verify_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Verify attempts'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'next_verify'], name='transaction_verify_due'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0005_transaction_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('phase', models.SmallIntegerField(choices=[(0, 'Create'), (1, 'Verify'), (2, 'Refund')], verbose_name='Phase')),
+                ('code', models.CharField(blank=True, max_length=32, null=True, verbose_name='Pay Portal Code')),
+                ('status', models.SmallIntegerField(blank=True, choices=[(-3, 'Refund failed by lack of funds'), (-2, 'Refund Failed'), (-1, 'Refunded'), (0, 'Successful'), (1, 'Wait ...'), (2, 'Canceled'), (3, 'Wait for Bank'), (4, 'Canceled By User'), (5, 'Failed'), (6, 'Api Key is invalid'), (7, 'Transaction ID is invalid'), (8, 'Amount is invalid'), (9, 'Card is invalid'), (10, 'Balance is not enough')], null=True, verbose_name='Status')),
+                ('http_status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='HTTP Status')),
+                ('latency', models.PositiveIntegerField(verbose_name='Latency (ms)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Create Date')),
+                ('transaction', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='events', related_query_name='events', to='payment.transaction', verbose_name='Transaction')),
+            ],
+            options={
+                'verbose_name': 'Transaction Event',
+                'verbose_name_plural': 'Transaction Events',
+                'default_permissions': ('view',),
+                'indexes': [models.Index(fields=['transaction', 'created_at'], name='transaction_event_timeline'), models.Index(fields=['created_at'], name='transaction_event_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:36
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0006_transactionevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionDetail',
+            fields=[
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='detail', serialize=False, to='payment.transaction', verbose_name='Transaction')),
+                ('card_holder', models.CharField(max_length=19, validators=[django.core.validators.RegexValidator('^[\\d*]{4}(?:-[\\d*]{4}){3}$')], verbose_name='Card Number')),
+                ('shaparak_tracking_code', models.CharField(max_length=12, validators=[django.core.validators.RegexValidator('^\\d+$', 'This field only include number', 'not_number')], verbose_name='Tracking Code')),
+                ('description', models.TextField(blank=True, null=True, verbose_name='Description')),
+                ('other', models.JSONField(blank=True, null=True, verbose_name='Other Information')),
+            ],
+            options={
+                'verbose_name': 'Transaction Detail',
+                'verbose_name_plural': 'Transaction Details',
+            },
+        ),
+    ]
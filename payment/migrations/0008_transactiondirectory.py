@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0007_transactiondetail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionDirectory',
+            fields=[
+                ('transaction_id', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Transaction ID')),
+                ('order_id', models.BigIntegerField(verbose_name='Order ID')),
+            ],
+            options={
+                'verbose_name': 'Transaction Directory',
+                'verbose_name_plural': 'Transaction Directory',
+                'default_permissions': (),
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0008_transactiondirectory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefundBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=128, verbose_name='Name')),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='Create Date')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+            ],
+            options={
+                'verbose_name': 'Refund Batch',
+                'verbose_name_plural': 'Refund Batches',
+            },
+        ),
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveBigIntegerField(verbose_name='Amount')),
+                ('status', models.SmallIntegerField(choices=[(0, 'Pending'), (1, 'Processing'), (2, 'Successful'), (3, 'Failed'), (4, 'Skipped')], default=0, verbose_name='Status')),
+                ('code', models.CharField(blank=True, max_length=32, null=True, verbose_name='Pay Portal Code')),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='Create Date')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processed at')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refunds', related_query_name='refunds', to='payment.transaction', verbose_name='Transaction')),
+                ('batch', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='refunds', to='payment.refundbatch', verbose_name='Batch')),
+            ],
+            options={
+                'verbose_name': 'Refund',
+                'verbose_name_plural': 'Refunds',
+                'indexes': [models.Index(fields=['batch', 'status'], name='refund_batch_status')],
+            },
+        ),
+    ]
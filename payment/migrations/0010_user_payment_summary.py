@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payment', '0009_refund'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPaymentSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payment_summary', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+                ('total_paid', models.BigIntegerField(default=0, verbose_name='Total paid')),
+                ('successful_count', models.IntegerField(default=0, verbose_name='Successful transactions')),
+                ('total_refunded', models.BigIntegerField(default=0, verbose_name='Total refunded')),
+                ('refunded_count', models.IntegerField(default=0, verbose_name='Refunded transactions')),
+                ('failed_count', models.IntegerField(default=0, verbose_name='Failed transactions')),
+                ('last_payment_at', models.DateTimeField(blank=True, null=True, verbose_name='Last payment at')),
+                ('last_payment_amount', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Last payment amount')),
+            ],
+            options={
+                'verbose_name': 'User Payment Summary',
+                'verbose_name_plural': 'User Payment Summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0010_user_payment_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardSequence',
+            fields=[
+                ('shard', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Shard')),
+                ('last_id', models.BigIntegerField(verbose_name='Last ID')),
+            ],
+            options={
+                'verbose_name': 'Shard Sequence',
+                'verbose_name_plural': 'Shard Sequences',
+                'default_permissions': (),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0011_shard_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactionevent',
+            name='transaction',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='events', related_query_name='events', to='payment.transaction', verbose_name='Transaction'),
+        ),
+    ]
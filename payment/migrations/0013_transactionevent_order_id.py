@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def detach_orphan_events(apps, schema_editor):
+    # Events of failed creates recorded without constraint refer to transactions that were never saved
+    TransactionEvent = apps.get_model('payment', 'TransactionEvent')
+    Transaction = apps.get_model('payment', 'Transaction')
+    database = schema_editor.connection.alias
+    TransactionEvent.objects.using(database).exclude(
+        transaction_id__in=Transaction.objects.using(database).values('pk')
+    ).update(transaction=None)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0012_transactionevent_no_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionevent',
+            name='order_id',
+            field=models.CharField(blank=True, max_length=150, null=True, verbose_name='Order ID'),
+        ),
+        migrations.AlterField(
+            model_name='transactionevent',
+            name='transaction',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='events', related_query_name='events', to='payment.transaction', verbose_name='Transaction'),
+        ),
+        migrations.RunPython(detach_orphan_events, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transactionevent',
+            name='transaction',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='events', related_query_name='events', to='payment.transaction', verbose_name='Transaction'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionevent',
+            index=models.Index(condition=models.Q(('order_id__isnull', False)), fields=['order_id'], name='transaction_event_order'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+from django.db.models import F
+from django.utils.timezone import now
+
+from payment.conf import get_setting
+from payment.status import StatusChoices
+
+
+def schedule_pending(apps, schema_editor):
+    # Transactions pending before 0004 have no next verify and are never claimed by VerifyScheduler
+    # They are due from their creation, So oldest ones are verified first
+    Transaction = apps.get_model('payment', 'Transaction')
+    Transaction.objects.using(schema_editor.connection.alias).filter(
+        status__in=(StatusChoices.WAIT_FOR_PAY, StatusChoices.WAIT_FOR_BANK),
+        next_verify__isnull=True,
+        create_date__gt=now() - get_setting('VERIFY_EXPIRY'),
+    ).update(next_verify=F('create_date'))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0013_transactionevent_order_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(schedule_pending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('payment', '0014_backfill_next_verify'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='idempotency_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Idempotency Fingerprint'),
+        ),
+    ]
@@ -8,6 +8,9 @@ from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
 
 from payment import globals, registry
+from payment.conf import get_setting
+from payment.routers import get_read_database
+from payment.state_machine import FINAL_STATUSES, PENDING_STATUSES
 from payment.status import StatusChoices
 from payment.validators import card_holder_validator, number_only_validator
 
@@ -42,6 +45,42 @@ class PayPortal(models.Model):
         return import_string(self.backend)
 
 
+# Fields that hot paths (verify, pending scans) never read, In split layout they are stored in TransactionDetail
+COLD_FIELDS = ('description', 'other', 'card_holder', 'shaparak_tracking_code')
+
+
+def is_split_layout():
+    return get_setting('TRANSACTION_LAYOUT') == 'split'
+
+
+class TransactionQuerySet(models.QuerySet):
+    def from_replica(self):
+        """
+        Read from a replica database, Use it only for lists, exports and analytics
+        """
+        return self.using(get_read_database())
+
+    def pending(self):
+        return self.filter(status__in=PENDING_STATUSES)
+
+    def final(self):
+        return self.filter(status__in=FINAL_STATUSES)
+
+    def with_linked_objects(self):
+        """
+        Fetch linked objects of transactions with one query per content type
+        """
+        return self.prefetch_related('linked_content_object')
+
+    def with_cold_fields(self):
+        """
+        Load cold fields with transaction in same query when they are in TransactionDetail
+        """
+        if is_split_layout():
+            return self.select_related('detail')
+        return self
+
+
 class Transaction(models.Model):
     class Meta:
         verbose_name = _("Transaction")
@@ -49,6 +88,11 @@ class Transaction(models.Model):
         constraints = (
             models.UniqueConstraint(fields=('transaction_id',), condition=Q(transaction_id__isnull=False),
                                     name="transaction_unique"),
+            models.UniqueConstraint(fields=('user', 'idempotency_key'), condition=Q(idempotency_key__isnull=False),
+                                    name="transaction_idempotency_key_unique"),
+        )
+        indexes = (
+            models.Index(fields=('status', 'next_verify'), name="transaction_verify_due"),
         )
         default_permissions = [
             ("create", _("Can Create a new Transaction")),
@@ -75,11 +119,19 @@ class Transaction(models.Model):
     status = models.SmallIntegerField(_("Status"), choices=StatusChoices.choices)
     description = models.TextField(_("Description"), null=True, blank=True)
     other = models.JSONField(_("Other Information"), null=True, blank=True)
+    idempotency_key = models.CharField(_("Idempotency Key"), max_length=64, null=True, blank=True)
+    # Hash of portal, amount and callback URL of request that used idempotency key
+    idempotency_fingerprint = models.CharField(_("Idempotency Fingerprint"), max_length=64, null=True, blank=True,
+                                               editable=False)
+
+    objects = TransactionQuerySet.as_manager()
 
     # Important Times
     create_date = models.DateTimeField(_("Create Date"), auto_now_add=True)
     create_transaction_at = models.DateTimeField(_("Create on portal at"), null=True)
     last_verify = models.DateTimeField(_("Last verify"), null=True)
+    next_verify = models.DateTimeField(_("Next verify"), null=True, blank=True)
+    verify_attempts = models.PositiveSmallIntegerField(_("Verify attempts"), default=0)
     last_edit = models.DateTimeField(_("Last Edit"), auto_now=True)
 
     # Functional methods
@@ -91,8 +143,16 @@ class Transaction(models.Model):
     def create(self, callback_uri, **kwargs) -> bool:
         return self.backend_controller.create(callback_uri, **kwargs)
 
-    def verify(self):
-        self.backend_controller.verify_transaction()
+    def create_idempotent(self, callback_uri, idempotency_key, **kwargs):
+        """
+        Create transaction on pay portal once per idempotency key of user
+        Return (transaction, created), transaction is the existing one when key used before
+        """
+        from payment.idempotency import create_idempotent
+        return create_idempotent(self, callback_uri, idempotency_key, **kwargs)
+
+    def verify(self, send_signals=True, **kwargs):
+        self.backend_controller.verify_transaction(send_signals, **kwargs)
 
     def refund(self):
         self.backend_controller.refund_transaction()
@@ -105,7 +165,243 @@ class Transaction(models.Model):
         return (max_id + 1) if max_id else 1
 
     def locate_id(self):
+        from payment.sharding import allocate_id, get_shard, is_sharded
+
+        if is_sharded():
+            self.id = allocate_id(get_shard(self))
+            return
         self.id = self.get_next_available_id()
 
     def get_redirect_url(self):
         return self.backend_controller.get_redirect_url()
+
+    # Cold fields
+
+    @property
+    def cold(self):
+        """
+        Object that holds cold fields (COLD_FIELDS) of transaction
+        It is TransactionDetail of transaction in split layout (Loaded lazily) and transaction itself in inline layout
+        """
+        if not is_split_layout():
+            return self
+        try:
+            return self.detail
+        except TransactionDetail.DoesNotExist:
+            # Not moved yet, Cold fields are still inline
+            self.detail = TransactionDetail(transaction=self, **{field: getattr(self, field) for field in COLD_FIELDS})
+            return self.detail
+
+    def move_cold_fields(self):
+        """
+        Move cold fields of a new transaction to its detail in split layout, Call save_cold() after save()
+        """
+        if not is_split_layout():
+            return
+        self.detail = TransactionDetail(transaction=self, **{field: getattr(self, field) for field in COLD_FIELDS})
+        for field in COLD_FIELDS:
+            setattr(self, field, self._meta.get_field(field).get_default())
+
+    def set_cold(self, field, value):
+        """
+        Set a cold field, save_cold() writes only cold fields changed by it
+        """
+        cold = self.cold
+        if getattr(cold, field) != value:
+            setattr(cold, field, value)
+            if cold is not self:
+                self.__dict__.setdefault('_changed_cold_fields', set()).add(field)
+
+    def save_cold(self):
+        """
+        Write detail of transaction in split layout, A new detail is inserted and a saved one is updated with fields
+        changed by set_cold() (Nothing is read or written when none changed)
+        """
+        if not is_split_layout():
+            return
+        changed = self.__dict__.pop('_changed_cold_fields', None)
+        if not Transaction.detail.is_cached(self):
+            return
+        if self.detail._state.adding:
+            self.detail.save()
+        elif changed:
+            self.detail.save(update_fields=changed)
+
+
+class TransactionDetail(models.Model):
+    """
+    Cold fields of transaction in split layout (settings.PAYMENT_TRANSACTION_LAYOUT = 'split')
+    """
+
+    class Meta:
+        verbose_name = _("Transaction Detail")
+        verbose_name_plural = _("Transaction Details")
+
+    transaction = models.OneToOneField(Transaction, models.CASCADE, primary_key=True, related_name='detail',
+                                       verbose_name=_("Transaction"))
+    card_holder = models.CharField(_("Card Number"), max_length=19, validators=(card_holder_validator,))
+    shaparak_tracking_code = models.CharField(_("Tracking Code"), max_length=12, validators=(number_only_validator,))
+    description = models.TextField(_("Description"), null=True, blank=True)
+    other = models.JSONField(_("Other Information"), null=True, blank=True)
+
+
+class TransactionDirectory(models.Model):
+    """
+    Map gateway transaction ID to order ID (and so shard) of sharded transactions
+    """
+
+    class Meta:
+        verbose_name = _("Transaction Directory")
+        verbose_name_plural = _("Transaction Directory")
+        default_permissions = ()
+
+    transaction_id = models.CharField(_("Transaction ID"), max_length=255, primary_key=True)
+    order_id = models.BigIntegerField(_("Order ID"))
+
+
+class ShardSequence(models.Model):
+    """
+    Last order ID allocated on a shard, Kept in database of the shard
+    """
+
+    class Meta:
+        verbose_name = _("Shard Sequence")
+        verbose_name_plural = _("Shard Sequences")
+        default_permissions = ()
+
+    shard = models.CharField(_("Shard"), max_length=64, primary_key=True)
+    last_id = models.BigIntegerField(_("Last ID"))
+
+
+class EventPhaseChoices(models.IntegerChoices):
+    CREATE = 0, _("Create")
+    VERIFY = 1, _("Verify")
+    REFUND = 2, _("Refund")
+
+
+class TransactionEventQuerySet(models.QuerySet):
+    def timeline(self, transaction):
+        """
+        Events of transaction in order of occurrence, Served by (transaction, created_at) index
+        """
+        return self.filter(transaction_id=getattr(transaction, 'pk', transaction)).order_by('created_at', 'id')
+
+    def of_order(self, order_id):
+        """
+        Events of failed creates of order ID sent to pay portal, Served by order_id index
+        """
+        return self.filter(order_id=order_id).order_by('created_at', 'id')
+
+
+class TransactionEvent(models.Model):
+    """
+    Append-only log of each request sent to pay portal for a transaction
+    """
+
+    class Meta:
+        verbose_name = _("Transaction Event")
+        verbose_name_plural = _("Transaction Events")
+        indexes = (
+            models.Index(fields=('transaction', 'created_at'), name="transaction_event_timeline"),
+            models.Index(fields=('created_at',), name="transaction_event_created"),
+            models.Index(fields=('order_id',), name="transaction_event_order", condition=Q(order_id__isnull=False)),
+        )
+        default_permissions = ('view',)
+
+    objects = TransactionEventQuerySet.as_manager()
+
+    id = models.BigAutoField(primary_key=True)
+    transaction = models.ForeignKey(Transaction, models.CASCADE, related_name='events', related_query_name='events',
+                                    verbose_name=_("Transaction"), db_index=False, null=True, blank=True)
+    # Events of failed creates have no transaction, Their transaction is never saved and its ID is reused
+    order_id = models.CharField(_("Order ID"), max_length=150, null=True, blank=True)
+    phase = models.SmallIntegerField(_("Phase"), choices=EventPhaseChoices.choices)
+    code = models.CharField(_("Pay Portal Code"), max_length=32, null=True, blank=True)
+    status = models.SmallIntegerField(_("Status"), choices=StatusChoices.choices, null=True, blank=True)
+    http_status = models.PositiveSmallIntegerField(_("HTTP Status"), null=True, blank=True)
+    latency = models.PositiveIntegerField(_("Latency (ms)"))
+    created_at = models.DateTimeField(_("Create Date"), auto_now_add=True)
+
+
+class RefundStatusChoices(models.IntegerChoices):
+    PENDING = 0, _("Pending")
+    PROCESSING = 1, _("Processing")
+    SUCCESSFUL = 2, _("Successful")
+    FAILED = 3, _("Failed")
+    SKIPPED = 4, _("Skipped")
+
+
+class RefundBatch(models.Model):
+    class Meta:
+        verbose_name = _("Refund Batch")
+        verbose_name_plural = _("Refund Batches")
+
+    name = models.CharField(_("Name"), max_length=128, blank=True)
+    create_date = models.DateTimeField(_("Create Date"), auto_now_add=True)
+    finished_at = models.DateTimeField(_("Finished at"), null=True, blank=True)
+
+    def __str__(self):
+        return self.name or str(self.pk)
+
+
+class RefundQuerySet(models.QuerySet):
+    def reserved(self):
+        """
+        Refunds that reserve amount of their transaction (Not failed or skipped)
+        """
+        return self.exclude(status__in=(RefundStatusChoices.FAILED, RefundStatusChoices.SKIPPED))
+
+
+class Refund(models.Model):
+    """
+    Ledger of full and partial refunds of transactions
+    """
+
+    class Meta:
+        verbose_name = _("Refund")
+        verbose_name_plural = _("Refunds")
+        indexes = (
+            models.Index(fields=('batch', 'status'), name="refund_batch_status"),
+        )
+
+    objects = RefundQuerySet.as_manager()
+
+    batch = models.ForeignKey(RefundBatch, models.CASCADE, related_name='refunds', verbose_name=_("Batch"),
+                              null=True, blank=True, db_index=False)
+    transaction = models.ForeignKey(Transaction, models.CASCADE, related_name='refunds', related_query_name='refunds',
+                                    verbose_name=_("Transaction"))
+    amount = models.PositiveBigIntegerField(_("Amount"))
+    status = models.SmallIntegerField(_("Status"), choices=RefundStatusChoices.choices,
+                                      default=RefundStatusChoices.PENDING)
+    code = models.CharField(_("Pay Portal Code"), max_length=32, null=True, blank=True)
+    create_date = models.DateTimeField(_("Create Date"), auto_now_add=True)
+    processed_at = models.DateTimeField(_("Processed at"), null=True, blank=True)
+
+    @property
+    def is_full(self):
+        return self.amount == self.transaction.amount
+
+
+class UserPaymentSummary(models.Model):
+    """
+    Totals of final transactions of a user, Kept up to date by payment.summary
+    Fix drifts by ``rebuild_payment_summaries`` command
+    """
+
+    class Meta:
+        verbose_name = _("User Payment Summary")
+        verbose_name_plural = _("User Payment Summaries")
+
+    user = models.OneToOneField(get_user_model(), models.CASCADE, primary_key=True, related_name='payment_summary',
+                                verbose_name=_("User"))
+    # Paid amount of transactions that is not refunded
+    total_paid = models.BigIntegerField(_("Total paid"), default=0)
+    successful_count = models.IntegerField(_("Successful transactions"), default=0)
+    total_refunded = models.BigIntegerField(_("Total refunded"), default=0)
+    refunded_count = models.IntegerField(_("Refunded transactions"), default=0)
+    failed_count = models.IntegerField(_("Failed transactions"), default=0)
+    last_payment_at = models.DateTimeField(_("Last payment at"), null=True, blank=True)
+    last_payment_amount = models.PositiveBigIntegerField(_("Last payment amount"), null=True, blank=True)
+
+    def __str__(self):
+        return str(self.user)
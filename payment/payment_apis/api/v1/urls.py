@@ -1,3 +1,4 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from . import views
@@ -5,5 +6,9 @@ from . import views
 router = DefaultRouter()
 
 router.register("transaction", views.TransactionViewSet, basename="transaction")
+router.register("summary", views.UserPaymentSummaryViewSet, basename="summary")
 
-urlpatterns = router.urls
+urlpatterns = [
+    path("transaction/<pk>/wait/", views.TransactionEventsView.as_view(), name="transaction-wait"),
+    path("transaction/<pk>/events/", views.TransactionEventsView.as_view(stream=True), name="transaction-events"),
+] + router.urls
@@ -1,12 +1,29 @@
+import json
 import logging
+import time
 
-from rest_framework import mixins, viewsets
+import requests
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views import View
+
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
-from payment.models import Transaction
-from payment.status import StatusChoices
-from ... import serializers
+from payment.conf import get_setting
+from payment.deadline import deadline
+from payment.exceptions import DeadlineExceeded, FailedPaymentError, IdempotencyKeyReused
+from payment.models import Transaction, UserPaymentSummary
+from payment.profiling import profile_request
+from payment.routers import get_read_database
+from payment.sharding import MergedShards, is_sharded, shard_for_id, shard_for_key
+from ... import cache, serializers
+from ...broker import get_broker, get_transaction_channel
+from ...checkout import CREATE_QUERY_BUDGET, create_transaction, query_budget, submit_create
+from ...exceptions import BadGateway, GatewayTimeout
 
 logger = logging.getLogger(__name__)
 
@@ -19,21 +36,245 @@ class TransactionViewSet(mixins.RetrieveModelMixin,
     ]
     serializer_class = serializers.TransactionSerializer
 
+    def dispatch(self, request, *args, **kwargs):
+        # Deadline of request propagate to every gateway request sent by it
+        # ``self.action`` is set after dispatch starts
+        name = f'{self.__class__.__name__}.{self.action_map.get(request.method.lower())}'
+        with deadline(self.get_deadline(request)), profile_request(request, name) as profile:
+            response = super().dispatch(request, *args, **kwargs)
+            if profile is not None:
+                response['X-Payment-Profile-Id'] = profile.id
+            return response
+
+    def handle_exception(self, exc):
+        # Gateway errors of any action (create, verify) are errors of an upstream server
+        if isinstance(exc, (DeadlineExceeded, requests.Timeout)):
+            exc = GatewayTimeout()
+        elif isinstance(exc, requests.RequestException):
+            exc = BadGateway()
+        return super().handle_exception(exc)
+
+    @staticmethod
+    def get_deadline(request):
+        """
+        Seconds that request may take, Client can lower PAYMENT_API_DEADLINE by ``X-Request-Deadline`` header
+        """
+        seconds = get_setting('API_DEADLINE')
+        try:
+            requested = float(request.headers.get('X-Request-Deadline', ''))
+        except ValueError:
+            return seconds
+        return requested if seconds is None else min(requested, seconds)
+
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return serializers.TransactionCreateSerializer
+        return super().get_serializer_class()
+
     def get_queryset(self):
-        return Transaction.objects.filter(user=self.request.user)
+        # Portal is read by redirect_url of every serialized transaction
+        queryset = Transaction.objects.filter(user=self.request.user).select_related('portal').with_cold_fields()
+        if is_sharded():
+            return self.get_sharded_queryset(queryset)
+        # Lifecycle actions (verify) always read primary database
+        if self.action == 'list':
+            return queryset.using(get_read_database())
+        if self.action == 'retrieve':
+            return queryset.using(get_read_database(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)))
+        return queryset
+
+    def get_sharded_queryset(self, queryset):
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if pk is not None:
+            try:
+                return queryset.using(shard_for_id(pk))
+            except ValueError:
+                raise Http404
+        if get_setting('SHARD_KEY') == 'user':
+            return queryset.using(shard_for_key(self.request.user.pk))
+        # Transactions of user are on every shard
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not is_sharded() or get_setting('SHARD_KEY') == 'user':
+            return super().list(request, *args, **kwargs)
+        # Each page reads only its rows and rows before it from each shard
+        objects = MergedShards(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(objects)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(objects, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if cached := cache.get_cached_etag(pk):
+            etag, user_id = cached
+            if user_id == request.user.pk:
+                if self.is_not_modified(request, etag):
+                    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+                data = cache.get_cached_representation(pk, etag)
+                if data is not None:
+                    return Response(data, headers={'ETag': etag})
+
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        etag = cache.set_cached_representation(instance, data)
+        if self.is_not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
+
+    @staticmethod
+    def is_not_modified(request, etag):
+        """
+        Weak comparison of ETag with each tag of If-None-Match, ``*`` matches any transaction
+        """
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if etags == ['*']:
+            return True
+        return etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create transaction on pay portal and return its ID and redirect URL
+        Latency budget is one request to pay portal, bounded by deadline of request (PAYMENT_API_DEADLINE)
+
+        ``Idempotency-Key`` header makes retries return the transaction created by first request, Reusing it for
+        another portal, amount or callback URL returns 422
+        ``Prefer: respond-async`` header returns 202 before pay portal responds, Follow it by ``wait`` or ``events``
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key and len(idempotency_key) > Transaction._meta.get_field('idempotency_key').max_length:
+            return Response({'detail': "Idempotency-Key is too long"}, status=status.HTTP_400_BAD_REQUEST)
+        transaction = Transaction(portal=data['portal'], amount=data['amount'], user=request.user,
+                                  description=data.get('description') or None)
+
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            if idempotency_key:
+                return Response({'detail': "Idempotency-Key is not supported by async create"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            submit_create(transaction, data['callback_url'])
+            return Response({'id': transaction.pk, 'status': transaction.status}, status=status.HTTP_202_ACCEPTED)
+
+        with query_budget(CREATE_QUERY_BUDGET, "Create transaction API"):
+            try:
+                transaction, created = create_transaction(transaction, data['callback_url'], idempotency_key)
+            except FailedPaymentError as e:
+                return Response({'detail': str(e), 'code': e.code, 'status': e.status},
+                                status=status.HTTP_400_BAD_REQUEST)
+            except IdempotencyKeyReused as e:
+                return Response({'detail': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if transaction._state.adding:
+            return Response({'detail': "Pay portal rejected transaction"}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({
+            'id': transaction.pk,
+            'transaction_id': transaction.transaction_id,
+            'status': transaction.status,
+            'redirect_url': transaction.get_redirect_url(),
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     @action(detail=True, url_path="verify", url_name="verify")
     def verify(self, request, *args, **kwargs):
         obj: Transaction = self.get_object()
-        prev_status = obj.status
-        obj.verify()
-        if prev_status != obj.status == StatusChoices.SUCCESSFUL:
-            if obj.linked_contenttype is not None:
-                if hasattr(obj.linked_contenttype.model_class(), "on_transaction_successful") and callable(
-                        obj.linked_contenttype.model_class().on_transaction_successful):
-                    try:
-                        obj.linked_contenttype.model_class().on_transaction_successful(transaction=obj, request=request)
-                    except Exception as e:
-                        logger.warning(str(e), exc_info=True)
-
+        obj.verify(request=request)
         return self.retrieve(request, *args, **kwargs)
+
+
+class TransactionEventsView(View):
+    """
+    Long-poll (``wait``) and Server-Sent Events (``events``) of status of transaction
+    Async view, Waiting clients hold no worker thread when served by ASGI
+    Authentication, permissions and lookup are of TransactionViewSet and run before waiting
+    """
+    stream = False
+
+    @staticmethod
+    def get_object(request, pk):
+        """
+        Return (transaction, None) or (None, error response rendered by TransactionViewSet)
+        """
+        view = TransactionViewSet(action_map={'get': 'retrieve'}, args=(), kwargs={'pk': pk}, format_kwarg=None)
+        view.request = request = view.initialize_request(request, pk=pk)
+        view.headers = view.default_response_headers
+        # Errors fall back to the first renderer (JSON) when client accepts only text/event-stream
+        request.accepted_renderer, request.accepted_media_type = view.perform_content_negotiation(request, force=True)
+        try:
+            view.perform_authentication(request)
+            view.check_permissions(request)
+            view.check_throttles(request)
+            return view.get_object(), None
+        except Exception as exc:
+            return None, view.finalize_response(request, view.handle_exception(exc))
+
+    async def get(self, request, pk):
+        obj, response = await sync_to_async(self.get_object)(request, pk)
+        if response is not None:
+            return response
+        channel = get_transaction_channel(obj.pk)
+        if self.stream:
+            return self.events(request, channel)
+        return await self.wait(request, channel)
+
+    @staticmethod
+    async def wait(request, channel):
+        """
+        Pass last received ``version`` and receive next event or 204 on timeout
+        """
+        try:
+            version = int(request.GET.get('version', 0))
+            timeout = min(float(request.GET.get('timeout', get_setting('EVENT_WAIT_TIMEOUT'))),
+                          get_setting('EVENT_WAIT_TIMEOUT'))
+        except ValueError:
+            return JsonResponse({'detail': 'Invalid version or timeout.'}, status=status.HTTP_400_BAD_REQUEST)
+        event = await get_broker().async_wait(channel, version, timeout)
+        if event is None:
+            return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+        version, message = event
+        return JsonResponse({'version': version, **message})
+
+    @staticmethod
+    def events(request, channel):
+        """
+        Stream events with ``Last-Event-ID`` resume and keep-alive pings
+        """
+        try:
+            version = int(request.headers.get('Last-Event-ID') or request.GET.get('version', 0))
+        except ValueError:
+            version = 0
+
+        async def stream(version):
+            broker = get_broker()
+            deadline = time.monotonic() + get_setting('EVENT_STREAM_MAX_DURATION')
+            while (remaining := deadline - time.monotonic()) > 0:
+                event = await broker.async_wait(channel, version, min(get_setting('EVENT_WAIT_TIMEOUT'), remaining))
+                if event is None:
+                    # Keep connection alive
+                    yield ": ping\n\n"
+                    continue
+                version, message = event
+                yield f"id: {version}\ndata: {json.dumps(message)}\n\n"
+                if message.get('deleted'):
+                    # Transaction rejected by pay portal, Nothing is published after it
+                    return
+
+        response = StreamingHttpResponse(stream(version), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class UserPaymentSummaryViewSet(viewsets.GenericViewSet):
+    permission_classes = [
+        IsAuthenticated
+    ]
+    serializer_class = serializers.UserPaymentSummarySerializer
+
+    def list(self, request, *args, **kwargs):
+        """
+        Summary of transactions of current user, Read by primary key of summary instead of aggregating transactions
+        """
+        summary = UserPaymentSummary.objects.filter(pk=request.user.pk).first() or \
+            UserPaymentSummary(user_id=request.user.pk)
+        return Response(self.get_serializer(summary).data)
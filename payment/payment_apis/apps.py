@@ -1,5 +1,6 @@
 from django.apps import AppConfig
 from django.core import checks
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
 from .checks import check_rest_framework_installed
@@ -11,4 +12,25 @@ class PaymentApisConfig(AppConfig):
     verbose_name = _("Payment APIs")
 
     def ready(self):
+        from payment import signals
+        from payment.models import PayPortal, Transaction
+        from .broker import publish_transaction, publish_transactions
+        from .cache import invalidate_cached_etag, update_cached_etag, update_cached_etags
+        from .checkout import invalidate_portal
+
         checks.register(check_rest_framework_installed)
+        post_save.connect(update_cached_etag, sender=Transaction)
+        post_delete.connect(invalidate_cached_etag, sender=Transaction)
+        post_save.connect(publish_transaction, sender=Transaction)
+        post_delete.connect(publish_transaction, sender=Transaction)
+        # Chunks of bulk operations are handled by receivers of batch signals
+        signals.post_verify_transaction.batched.connect(publish_transaction)
+        signals.post_refund_transaction.batched.connect(publish_transaction)
+        signals.post_transition.batched.connect(update_cached_etag)
+        signals.post_transition.batched.connect(publish_transaction)
+        signals.post_verify_batch.connect(publish_transactions)
+        signals.post_refund_batch.connect(publish_transactions)
+        signals.post_transition_batch.connect(update_cached_etags)
+        signals.post_transition_batch.connect(publish_transactions)
+        post_save.connect(invalidate_portal, sender=PayPortal)
+        post_delete.connect(invalidate_portal, sender=PayPortal)
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.db.models.signals import post_delete
+from django.utils.module_loading import import_string
+
+from payment.conf import get_cache, get_setting
+from payment.status import StatusChoices
+
+__all__ = ['BaseBroker', 'LocalBroker', 'CacheBroker', 'get_broker', 'publish_transaction',
+           'publish_transactions']
+
+
+class BaseBroker:
+    """
+    Fan out messages of channels to waiting clients
+    Each channel keeps only its last message with a version that increase on every publish
+    """
+
+    def get(self, channel):
+        """
+        Return (version, message) of channel or (0, None) when nothing published
+        """
+        raise NotImplementedError
+
+    async def aget(self, channel):
+        return await sync_to_async(self.get)(channel)
+
+    def _publish(self, channel, message):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        if self.get(channel)[1] == message:
+            return
+        self._publish(channel, message)
+
+    def wait(self, channel, version, timeout):
+        """
+        Block until channel have a message newer than version and return (version, message)
+        Return None on timeout
+        """
+        raise NotImplementedError
+
+    async def async_wait(self, channel, version, timeout):
+        """
+        Async version of wait, Polls the channel without holding a thread
+        """
+        interval = get_setting('EVENT_BROKER_POLL_INTERVAL')
+        deadline = time.monotonic() + timeout
+        while True:
+            current = await self.aget(channel)
+            if current[0] > version:
+                return current
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(interval, remaining))
+
+
+class LocalBroker(BaseBroker):
+    """
+    In memory broker, Only clients connected to same process receive messages
+    """
+    max_channels = 10000
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._channels = OrderedDict()
+        # Shared by all channels, So version of an evicted channel never goes back on its next publish
+        self._version = 0
+        # Futures of async waiters by channel, Resolved on their event loops by publish
+        self._waiters = {}
+
+    def get(self, channel):
+        with self._condition:
+            return self._channels.get(channel, (0, None))
+
+    async def aget(self, channel):
+        return self.get(channel)
+
+    def _publish(self, channel, message):
+        with self._condition:
+            self._version += 1
+            version = self._version
+            self._channels.pop(channel, None)
+            self._channels[channel] = (version, message)
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+            self._condition.notify_all()
+            for loop, future in self._waiters.pop(channel, ()):
+                loop.call_soon_threadsafe(_resolve, future, (version, message))
+
+    def wait(self, channel, version, timeout):
+        with self._condition:
+            if self._condition.wait_for(lambda: self._channels.get(channel, (0, None))[0] > version, timeout):
+                return self._channels[channel]
+        return None
+
+    async def async_wait(self, channel, version, timeout):
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._condition:
+            current = self._channels.get(channel, (0, None))
+            if current[0] > version:
+                return current
+            self._waiters.setdefault(channel, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._condition:
+                waiters = self._waiters.get(channel, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(channel, None)
+
+
+class CacheBroker(BaseBroker):
+    """
+    Broker over the payment cache, Works between processes and servers by polling the cache
+    """
+
+    @staticmethod
+    def _key(channel):
+        return f"payment:events:{channel}"
+
+    def get(self, channel):
+        return get_cache().get(self._key(channel), (0, None))
+
+    async def aget(self, channel):
+        return await get_cache().aget(self._key(channel), (0, None))
+
+    def _publish(self, channel, message):
+        cache = get_cache()
+        version_key = self._key(channel) + ":version"
+        cache.add(version_key, 0, timeout=None)
+        version = cache.incr(version_key)
+        cache.set(self._key(channel), (version, message), timeout=None)
+
+    def wait(self, channel, version, timeout):
+        interval = get_setting('EVENT_BROKER_POLL_INTERVAL')
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.get(channel)
+            if current[0] > version:
+                return current
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+@lru_cache
+def get_broker() -> BaseBroker:
+    return import_string(get_setting('EVENT_BROKER'))()
+
+
+def get_transaction_channel(pk):
+    return f"transaction:{pk}"
+
+
+def publish_transaction(sender, transaction=None, instance=None, signal=None, **kwargs):
+    """
+    Receiver of transaction lifecycle signals, post_save and post_delete that publish status of transaction
+    Chunks of batch signals are published by publish_transactions
+    post_delete publishes terminal event of transactions that pay portal rejected
+    """
+    transaction = transaction or instance
+    if transaction is None or transaction.pk is None:
+        return
+    _publish(get_broker(), transaction, deleted=signal is post_delete)
+
+
+def publish_transactions(sender, transactions, **kwargs):
+    """
+    Receiver of batch signals of transactions
+    """
+    broker = get_broker()
+    for transaction in transactions:
+        _publish(broker, transaction)
+
+
+def _publish(broker, transaction, deleted=False):
+    # Created on pay portal when it has transaction ID, Before it a transaction of async create is only queued
+    created = transaction.transaction_id is not None
+    redirect = created and not deleted and transaction.status == StatusChoices.WAIT_FOR_PAY
+    broker.publish(get_transaction_channel(transaction.pk), {
+        'id': transaction.pk,
+        'status': int(transaction.status) if transaction.status is not None else None,
+        'last_edit': transaction.last_edit.isoformat() if transaction.last_edit else None,
+        'transaction_id': transaction.transaction_id,
+        'created': created,
+        'redirect_url': transaction.get_redirect_url() if redirect else None,
+        'deleted': deleted,
+    })
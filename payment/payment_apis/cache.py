@@ -0,0 +1,63 @@
+from payment.conf import get_cache, get_setting
+
+__all__ = ['get_etag', 'get_cached_etag', 'get_cached_representation', 'set_cached_representation',
+           'update_cached_etag', 'update_cached_etags', 'invalidate_cached_etag']
+
+# Current ETag of each transaction is kept in cache with its owner and updated on every save.
+# Representations are stored under their ETag, so a representation built from an old row never served as new one.
+
+
+def _etag_key(pk):
+    return f"payment:transaction:{pk}:etag"
+
+
+def _representation_key(pk, etag):
+    return f"payment:transaction:{pk}:representation:{etag}"
+
+
+def get_etag(transaction):
+    return f'"{transaction.pk}-{int(transaction.last_edit.timestamp() * 1000000)}"'
+
+
+def get_cached_etag(pk):
+    """
+    Return (etag, user_id) of transaction or None when it is not cached
+    """
+    return get_cache().get(_etag_key(pk))
+
+
+def get_cached_representation(pk, etag):
+    return get_cache().get(_representation_key(pk, etag))
+
+
+def set_cached_representation(transaction, data):
+    etag = get_etag(transaction)
+    cache = get_cache()
+    timeout = get_setting('REPRESENTATION_CACHE_TIMEOUT')
+    # add() doesn't replace ETag that written by a newer save
+    cache.add(_etag_key(transaction.pk), (etag, transaction.user_id), timeout=timeout)
+    cache.set(_representation_key(transaction.pk, etag), data, timeout=timeout)
+    return etag
+
+
+def update_cached_etag(sender, instance=None, transaction=None, **kwargs):
+    """
+    Receiver of post_save and post_transition of transactions, Chunks of bulk_transition are written by
+    update_cached_etags
+    """
+    instance = instance or transaction
+    get_cache().set(_etag_key(instance.pk), (get_etag(instance), instance.user_id),
+                    timeout=get_setting('REPRESENTATION_CACHE_TIMEOUT'))
+
+
+def update_cached_etags(sender, transactions, **kwargs):
+    """
+    Receiver of post_transition_batch, Write ETags of whole chunk with one cache call
+    """
+    get_cache().set_many({
+        _etag_key(transaction.pk): (get_etag(transaction), transaction.user_id) for transaction in transactions
+    }, timeout=get_setting('REPRESENTATION_CACHE_TIMEOUT'))
+
+
+def invalidate_cached_etag(sender, instance, **kwargs):
+    get_cache().delete(_etag_key(instance.pk))
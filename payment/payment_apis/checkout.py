@@ -0,0 +1,108 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction as db_transaction
+
+from payment.conf import get_cache, get_setting
+from payment.models import PayPortal, Transaction
+from payment.profiling import count_queries
+from payment.status import StatusChoices
+
+__all__ = ['CREATE_QUERY_BUDGET', 'get_portal', 'invalidate_portal', 'create_transaction', 'submit_create',
+           'query_budget']
+
+logger = logging.getLogger(__name__)
+
+# Queries of create API (authentication excluded): INSERT of transaction and INSERT of its event
+# +1 on cache miss of pay portal and +1 on cache miss of idempotency key
+# Logged when exceeded in DEBUG mode and enforced by ``benchmark_hot_paths``
+CREATE_QUERY_BUDGET = 4
+
+
+def get_portal_cache_key(code_name):
+    return f"payment:portal:{code_name}"
+
+
+def get_portal(code_name):
+    """
+    Return pay portal by code name from cache, Read database only on cache miss
+    Return None when there is no pay portal with code name
+    """
+    cache = get_cache()
+    key = get_portal_cache_key(code_name)
+    portal = cache.get(key)
+    if portal is None:
+        portal = PayPortal.objects.filter(code_name=code_name).first()
+        if portal is not None:
+            cache.set(key, portal, get_setting('PORTAL_CACHE_TIMEOUT'))
+    return portal
+
+
+def invalidate_portal(sender, instance, **kwargs):
+    """
+    Receiver of post_save and post_delete of pay portals
+    """
+    get_cache().delete(get_portal_cache_key(instance.pk))
+
+
+def create_transaction(transaction, callback_url, idempotency_key=None, **kwargs):
+    """
+    Create transaction on pay portal, Return (transaction, created)
+    With idempotency key, transaction is the existing one when key used before
+    """
+    if idempotency_key:
+        return transaction.create_idempotent(callback_url, idempotency_key, **kwargs)
+    return transaction, transaction.create(callback_url, **kwargs)
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=get_setting('CHECKOUT_ASYNC_WORKERS'),
+                                       thread_name_prefix='payment-checkout')
+    return _executor
+
+
+def _create_in_background(transaction, callback_url, kwargs):
+    try:
+        if not transaction.create(callback_url, **kwargs):
+            transaction.delete()
+    except Exception as e:
+        logger.warning("Creating transaction %s failed: %s", transaction.pk, e, exc_info=True)
+        Transaction.objects.filter(pk=transaction.pk).delete()
+    finally:
+        connections.close_all()
+
+
+def submit_create(transaction, callback_url, **kwargs):
+    """
+    Save transaction as WAIT_FOR_PAY and create it on pay portal in background
+    Status of transaction is pushed to ``wait`` and ``events`` APIs, Event of create on pay portal has ``created``
+    and ``redirect_url``, Transaction is deleted when pay portal rejects it and its last event has ``deleted``
+    Background create is submitted when current database transaction (e.g. ATOMIC_REQUESTS) commits, So the worker
+    always sees the saved row
+    """
+    transaction.status = StatusChoices.WAIT_FOR_PAY
+    transaction.locate_id()
+    transaction.save(force_insert=True)
+    db_transaction.on_commit(lambda: get_executor().submit(_create_in_background, transaction, callback_url, kwargs),
+                             using=transaction._state.db)
+
+
+@contextmanager
+def query_budget(budget, name):
+    """
+    Log a warning when block runs more than budget queries, Only counted in DEBUG mode
+    """
+    if not settings.DEBUG:
+        yield
+        return
+    with count_queries() as counter:
+        yield
+    if counter.count > budget:
+        logger.warning("%s ran %d queries, Budget is %d", name, counter.count, budget)
@@ -0,0 +1,15 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class GatewayTimeout(APIException):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = _("Pay portal did not respond in time")
+    default_code = 'gateway_timeout'
+
+
+class BadGateway(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = _("Pay portal is not available")
+    default_code = 'bad_gateway'
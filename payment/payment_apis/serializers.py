@@ -1,10 +1,16 @@
+from django.core.validators import StepValueValidator
 from rest_framework import serializers
 
-from payment.models import Transaction
+from payment.models import Transaction, UserPaymentSummary
+from .checkout import get_portal
 
 
 class TransactionSerializer(serializers.ModelSerializer):
     redirect_url = serializers.SerializerMethodField()
+    # Cold fields may be stored in TransactionDetail (split layout)
+    card_holder = serializers.CharField(source='cold.card_holder', read_only=True)
+    shaparak_tracking_code = serializers.CharField(source='cold.shaparak_tracking_code', read_only=True)
+    description = serializers.CharField(source='cold.description', read_only=True, allow_null=True)
 
     class Meta:
         model = Transaction
@@ -27,3 +33,31 @@ class TransactionSerializer(serializers.ModelSerializer):
     @staticmethod
     def get_redirect_url(obj: Transaction):
         return obj.get_redirect_url()
+
+
+class UserPaymentSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserPaymentSummary
+        fields = [
+            'total_paid',
+            'successful_count',
+            'total_refunded',
+            'refunded_count',
+            'failed_count',
+            'last_payment_at',
+            'last_payment_amount',
+        ]
+
+
+class TransactionCreateSerializer(serializers.Serializer):
+    portal = serializers.SlugField(max_length=50)
+    amount = serializers.IntegerField(min_value=1000, validators=[StepValueValidator(1000)])
+    callback_url = serializers.URLField()
+    description = serializers.CharField(required=False, allow_blank=True)
+
+    @staticmethod
+    def validate_portal(value):
+        portal = get_portal(value)
+        if portal is None:
+            raise serializers.ValidationError("Pay portal does not exist")
+        return portal
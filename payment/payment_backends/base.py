@@ -1,16 +1,29 @@
 import logging
+import time
 
 import requests
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
+from django.db import DatabaseError
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
 from requests import Response
 
 from payment import signals
+from payment.conf import get_setting
+from payment.deadline import check_deadline
+from payment.events import record_event
 from payment.exceptions import FailedPaymentError
-from payment.models import Transaction
+from payment.models import COLD_FIELDS, EventPhaseChoices, Transaction, TransactionDirectory, is_split_layout
+from payment.payment_backends.latency import get_histogram, hedged
+from payment.payment_backends.traffic import get_recorder, get_replay
+from payment.profiling import get_profile, profiled
+from payment.registry import linked_registry
+from payment.routers import pin_transaction
+from payment.scheduler import get_backoff
+from payment.sharding import is_sharded, shard_for_id
+from payment.state_machine import FINAL_STATUSES, PENDING_STATUSES, REFUND_STATUSES, transition
 from payment.status import FAIL_MESSAGES, HARD_FAILED_STATUSES, StatusChoices
 
 __all__ = ['BaseBackend']
@@ -52,6 +65,13 @@ class BaseBackend:
         'card_holder',
         'shaparak_tracking_code',
     ]
+    # Personal data of users, Masked in recorded traffic (payment.payment_backends.traffic)
+    PII_FLAGS = [
+        'phone',
+        'national_code',
+        'allowed_card',
+        'card_holder',
+    ]
 
     # API Key in pay portal send to pay portal by this key name
     # Must override if pay portal use other key name
@@ -62,19 +82,41 @@ class BaseBackend:
     TRANSACTION_ID_KEY_NAME = 'trans_id'
     STATUS_FIELD = 'code'
 
+    # Pending transactions are not verified by scheduler after this duration from creation
+    # None means use settings.PAYMENT_VERIFY_EXPIRY
+    VERIFY_EXPIRY = None
+
+    # Send a second verify request when first one is slower than HEDGE_PERCENTILE of recent verifies
+    # None means use settings.PAYMENT_HEDGE_VERIFY
+    HEDGE_VERIFY = None
+
     def __init__(self, transaction: Transaction):
         self.transaction = transaction
 
     # ------------------------------------- CREATE ------------------------------------------------
 
+    @profiled()
     def create(self, callback_url, **kwargs) -> bool:
 
         signals.pre_create_transaction.send(self.__class__, transaction=self.transaction, callback_uri=callback_url)
+        started = time.monotonic()
         response = self.send_create_request(callback_url, **kwargs)
+        latency = time.monotonic() - started
+        # ID is located by send_create_request, delete() of a rejected transaction clears it
+        # Transaction of a failed create is not saved, Its event is kept by order ID instead
+        transaction_id, order_id = self.transaction.pk, self.get_order_id()
         if not response.ok:
+            self.record_event(EventPhaseChoices.CREATE, response, latency, transaction_id=transaction_id,
+                              order_id=order_id)
             signals.create_transaction_failed.send(self.__class__, request=response, transaction=self.transaction)
             return False
-        self.handle_create(response)
+        try:
+            self.handle_create(response)
+        except Exception as exc:
+            self.record_event(EventPhaseChoices.CREATE, response, latency, exc=exc, transaction_id=transaction_id,
+                              order_id=order_id)
+            raise
+        self.record_event(EventPhaseChoices.CREATE, response, latency)
         signals.post_create_transaction.send(self.__class__, transaction=self.transaction)
         return True
 
@@ -104,7 +146,16 @@ class BaseBackend:
             raise FailedPaymentError(detail=FAIL_MESSAGES[self.transaction.status], status=self.transaction.status,
                                      code=self.get_status(result))
         self.transaction.transaction_id = result[self.TRANSACTION_ID_KEY_NAME]
-        self.transaction.save()
+        self.transaction.verify_attempts = 0
+        self.schedule_next_verify()
+        self.transaction.move_cold_fields()
+        # ID is located before saving, force_insert skips the UPDATE that save() tries first
+        self.transaction.save(force_insert=self.transaction._state.adding)
+        self.transaction.save_cold()
+        if is_sharded():
+            TransactionDirectory.objects.create(transaction_id=self.transaction.transaction_id,
+                                                order_id=self.transaction.pk)
+        pin_transaction(self.transaction.pk)
 
     def send_create_request(self, callback_uri, **kwargs) -> Response:
 
@@ -120,11 +171,11 @@ class BaseBackend:
             URLValidator()(callback_uri)
         except ValidationError:
             raise ValueError("Callback URL is incorrect")
-        self.transaction.locate_id()
-        order_suffix = self.transaction.portal.order_id_prefix or self.transaction.portal.code_name
+        if self.transaction._state.adding:
+            self.transaction.locate_id()
         data = {
-            self.API_KEY_NAME: str(self.transaction.portal.api_key),
-            self.translate_flag('order_id'): f"{order_suffix}_{self.transaction.id}",
+            **self.get_auth_context(),
+            self.translate_flag('order_id'): self.get_order_id(),
             self.translate_flag('amount'): self.transaction.amount,
             self.translate_flag('callback_uri'): callback_uri,
             **self.get_create_context(**kwargs)
@@ -135,9 +186,16 @@ class BaseBackend:
         }
         if headers := self.get_headers():
             params['headers'] = headers
-        response = requests.post(**params)
+        response = self.post('CREATE', **params)
         return response
 
+    def get_order_id(self):
+        """
+        Order ID of transaction that is sent to pay portal
+        """
+        order_suffix = self.transaction.portal.order_id_prefix or self.transaction.portal.code_name
+        return f"{order_suffix}_{self.transaction.id}"
+
     def get_create_context(self, **kwargs):
         """
         This function get transaction and return data that will send additional to default data
@@ -166,13 +224,41 @@ class BaseBackend:
 
     # -------------------------------------- VERIFY --------------------------------------------
 
-    def verify_transaction(self):
-        signals.pre_verify_transaction.send(self.__class__, transaction=self.transaction)
+    @profiled()
+    def verify_transaction(self, send_signals=True, **kwargs):
+        """
+        Without send_signals, Caller sends pre_verify_batch and post_verify_batch for its chunk instead
+        kwargs are passed to handlers of linked model (e.g. request)
+        """
+        if send_signals:
+            signals.pre_verify_transaction.send(self.__class__, transaction=self.transaction)
+        started = time.monotonic()
         response = self.send_verify_request()
-        self.handle_verify(response)
-        signals.post_verify_transaction.send(self.__class__, transaction=self.transaction)
+        latency = time.monotonic() - started
+        previous_status = self.transaction.status
+        try:
+            self.handle_verify(response)
+        except Exception as exc:
+            self.record_event(EventPhaseChoices.VERIFY, response, latency, exc=exc)
+            raise
+        self.record_event(EventPhaseChoices.VERIFY, response, latency)
+        self.dispatch_verify(previous_status, **kwargs)
+        if send_signals:
+            signals.post_verify_transaction.send(self.__class__, transaction=self.transaction)
         return self.transaction
 
+    def dispatch_verify(self, previous_status, **kwargs):
+        """
+        Call successful or failed handler of linked model when verify finalized transaction
+        """
+        status = self.transaction.status
+        if previous_status == status:
+            return
+        if status == StatusChoices.SUCCESSFUL:
+            linked_registry.dispatch(self.transaction, 'successful', **kwargs)
+        elif status in FINAL_STATUSES - REFUND_STATUSES:
+            linked_registry.dispatch(self.transaction, 'failed', **kwargs)
+
     def handle_verify(self, response: Response):
         """
         This method for handle response status of verify request
@@ -188,20 +274,42 @@ class BaseBackend:
         status = self.ERROR_MAPPING.get(self.get_status(data))
         if status is None:
             raise FailedPaymentError(code=self.get_status(data), status=status)
-        self.transaction.status = status
         self.apply_to_transaction(data=data)
         self.transaction.last_verify = now()
-        self.transaction.save()
+        self.transaction.verify_attempts += 1
+        self.schedule_next_verify(status)
+        if transition(self.transaction, status,
+                      self.get_update_fields('last_verify', 'verify_attempts', 'next_verify')):
+            self.transaction.save_cold()
+        pin_transaction(self.transaction.pk)
 
     def send_verify_request(self) -> Response:
         if not self.URLS.get('VERIFY'):
             raise NotImplementedError("Define URLS['VERIFY'] or override .send_verify_request()")
         data = self.get_verify_context()
-        return requests.post(self.URLS['VERIFY'], json=data, headers=self.get_headers())
+        headers = self.get_headers()
+        if not self.is_hedge_verify():
+            return self.post('VERIFY', self.URLS['VERIFY'], json=data, headers=headers)
+        return hedged(lambda: self.post('VERIFY', self.URLS['VERIFY'], json=data, headers=headers),
+                      delay=self.get_hedge_delay(), timeout=check_deadline())
+
+    @classmethod
+    def is_hedge_verify(cls):
+        return get_setting('HEDGE_VERIFY') if cls.HEDGE_VERIFY is None else cls.HEDGE_VERIFY
+
+    @classmethod
+    def get_hedge_delay(cls):
+        """
+        Return delay of hedged verify request from latency histogram of verify requests
+        """
+        histogram = get_histogram(cls, 'VERIFY')
+        if histogram.count < get_setting('HEDGE_MIN_SAMPLES'):
+            return get_setting('HEDGE_DEFAULT_DELAY')
+        return histogram.percentile(get_setting('HEDGE_PERCENTILE'))
 
     def get_verify_context(self):
         return {
-            self.API_KEY_NAME: self.transaction.portal.api_key,
+            **self.get_auth_context(),
             self.TRANSACTION_ID_KEY_NAME: self.transaction.transaction_id
         }
 
@@ -209,10 +317,21 @@ class BaseBackend:
 
     # ------------------------------------ REFUND -----------------------------------------------
 
+    @profiled()
     def refund_transaction(self):
         signals.pre_refund_transaction.send(self.__class__, transaction=self.transaction)
+        started = time.monotonic()
         response = self.send_refund_request()
-        self.handle_refund(response)
+        latency = time.monotonic() - started
+        previous_status = self.transaction.status
+        try:
+            self.handle_refund(response)
+        except Exception as exc:
+            self.record_event(EventPhaseChoices.REFUND, response, latency, exc=exc)
+            raise
+        self.record_event(EventPhaseChoices.REFUND, response, latency)
+        if previous_status != self.transaction.status == StatusChoices.REFUNDED:
+            linked_registry.dispatch(self.transaction, 'refunded')
         signals.post_refund_transaction.send(self.__class__, transaction=self.transaction, response=response)
         return self.transaction
 
@@ -227,22 +346,50 @@ class BaseBackend:
         """
         if not self.ERROR_MAPPING:
             raise NotImplementedError
-        self.transaction.status = self.ERROR_MAPPING.get(self.get_status(response.json()),
-                                                         StatusChoices.REFUND_FAILED)
+        status = self.ERROR_MAPPING.get(self.get_status(response.json()), StatusChoices.REFUND_FAILED)
         self.transaction.last_verify = now()
-        self.transaction.save()
+        self.schedule_next_verify(status)
+        transition(self.transaction, status, ('last_verify', 'next_verify'))
+        pin_transaction(self.transaction.pk)
 
-    def send_refund_request(self) -> Response:
+    def send_refund_request(self, amount=None) -> Response:
+        """
+        :param: amount: Amount of partial refund, Whole amount of transaction by default
+        """
         if not self.URLS.get('REFUND'):
             raise NotImplementedError("Define URLS['REFUND'] or override .send_refund_request()")
         data = self.get_refund_context()
-        return requests.post(self.URLS['REFUND'], json=data, headers=self.get_headers())
+        if amount is not None:
+            data[self.translate_flag('amount')] = amount
+        return self.post('REFUND', self.URLS['REFUND'], json=data, headers=self.get_headers())
 
     def get_refund_context(self):
         return {}
 
     # ----------------------------------- END REFUND ------------------------------------------------
 
+    # ------------------------------------ SCHEDULE -------------------------------------------------
+
+    @classmethod
+    def get_verify_expiry(cls):
+        return cls.VERIFY_EXPIRY or get_setting('VERIFY_EXPIRY')
+
+    def schedule_next_verify(self, status=None):
+        """
+        Set next verify time of pending transaction by exponential backoff of its verify attempts
+        Final and expired transactions never scheduled again
+        :param: status: Status that transaction is moving to, Current status by default
+        """
+        current_time = now()
+        created_at = self.transaction.create_date or current_time
+        if ((self.transaction.status if status is None else status) not in PENDING_STATUSES or
+                current_time >= created_at + self.get_verify_expiry()):
+            self.transaction.next_verify = None
+            return
+        self.transaction.next_verify = current_time + get_backoff(self.transaction.verify_attempts)
+
+    # ---------------------------------- END SCHEDULE -----------------------------------------------
+
     # ------------------------------------- OTHER ---------------------------------------------------
 
     def get_redirect_url(self):
@@ -252,23 +399,94 @@ class BaseBackend:
 
     @classmethod
     def get_transaction_from_query_params(cls, query_params: dict):
-        return get_object_or_404(Transaction, transaction_id=query_params[cls.TRANSACTION_ID_KEY_NAME])
+        transaction_id = query_params[cls.TRANSACTION_ID_KEY_NAME]
+        if is_sharded():
+            order_id = get_object_or_404(TransactionDirectory, transaction_id=transaction_id).order_id
+            return get_object_or_404(Transaction.objects.using(shard_for_id(order_id)), pk=order_id)
+        return get_object_or_404(Transaction, transaction_id=transaction_id)
+
+    def post(self, phase, url, **kwargs) -> Response:
+        """
+        Send request to pay portal with timeout of current deadline and record its latency
+        Requests are recorded to PAYMENT_TRAFFIC_RECORD_PATH when set, and served by replay transport inside replay()
+        :param: phase: Key of URLS that request sent to
+        """
+        left = check_deadline()
+        timeout = get_setting('REQUEST_TIMEOUT')
+        started = time.monotonic()
+        if (transport := get_replay()) is not None:
+            response = transport.post(self, phase, url, **kwargs)
+        else:
+            response = requests.post(url, timeout=timeout if left is None else min(timeout, left), **kwargs)
+            if (recorder := get_recorder()) is not None:
+                recorder.record(self.__class__, phase, kwargs.get('json'), response, time.monotonic() - started)
+        latency = time.monotonic() - started
+        get_histogram(self.__class__, phase).record(latency)
+        if (profile := get_profile()) is not None:
+            profile.add_timing('gateway', f'{self.__class__.__name__}.{phase}', latency)
+        return response
 
     def get_headers(self):
         pass
 
+    def get_auth_context(self):
+        """
+        Return data that authenticate request on pay portal (API key by default)
+        """
+        return {self.API_KEY_NAME: str(self.transaction.portal.api_key)}
+
+    def get_update_fields(self, *fields):
+        """
+        Return fields of transaction that written after verify, RECEIVING_FLAGS that are transaction fields and fields
+        """
+        concrete_fields = {field.attname for field in Transaction._meta.concrete_fields}
+        if is_split_layout():
+            concrete_fields.difference_update(COLD_FIELDS)
+        return [flag for flag in self.RECEIVING_FLAGS if flag in concrete_fields] + list(fields)
+
     def apply_to_transaction(self, data: dict):
         for flag in self.RECEIVING_FLAGS:
             translated_flag = self.translate_flag(flag)
             if translated_flag in data:
                 try:
-                    setattr(self.transaction, flag, data.get(translated_flag))
+                    if flag in COLD_FIELDS:
+                        self.transaction.set_cold(flag, data.get(translated_flag))
+                    else:
+                        setattr(self.transaction, flag, data.get(translated_flag))
                 except AttributeError:
                     pass
 
+    def record_event(self, phase, response: Response, latency: float, exc=None, transaction_id=None, order_id=None):
+        """
+        Append request to event log of transaction, latency is in seconds
+        exc is the error raised by handling response, Status it carries (e.g. FailedPaymentError) is recorded
+        instead of status of transaction, And its class name when response has no code
+        order_id keeps event of a failed create whose transaction is not saved (See events.record_event)
+        """
+        if isinstance(exc, DatabaseError):
+            # Not a result of pay portal, And the broken database transaction can not take the event
+            return
+        try:
+            code = self.get_status(response.json())
+        except ValueError:
+            code = None
+        status = self.transaction.status
+        if exc is not None:
+            status = getattr(exc, 'status', status)
+            code = type(exc).__name__ if code is None else code
+        record_event(transaction_id or self.transaction.pk, phase, code=code, status=status,
+                     http_status=response.status_code, latency=latency * 1000, order_id=order_id)
+
     @classmethod
     def translate_flag(cls, flag):
         return cls.TRANSLATE_DICTIONARY.get(flag) or flag
 
+    @classmethod
+    def get_redact_keys(cls):
+        """
+        Keys of pay portal that are masked in recorded traffic, API key and translated PII_FLAGS
+        """
+        return {cls.API_KEY_NAME} | {cls.translate_flag(flag) for flag in cls.PII_FLAGS}
+
     def get_status(self, data: dict):
         return data.get(self.STATUS_FIELD)
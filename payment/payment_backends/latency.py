@@ -0,0 +1,97 @@
+import bisect
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from payment.conf import get_setting
+from payment.exceptions import DeadlineExceeded
+
+__all__ = ['LatencyHistogram', 'get_histogram', 'hedged']
+
+# Upper bounds of buckets in seconds, Grow by 25% from 1ms to about 2 minutes
+BUCKETS = tuple(0.001 * 1.25 ** index for index in range(54))
+
+
+class LatencyHistogram:
+    """
+    Thread-safe histogram of request latencies with fixed logarithmic buckets
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+
+    def record(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+
+    def percentile(self, percent):
+        """
+        Return upper bound of bucket that includes the percentile or None when histogram is empty
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            target = self.count * percent / 100
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return BUCKETS[min(index, len(BUCKETS) - 1)]
+        return BUCKETS[-1]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def get_histogram(backend_class, phase) -> LatencyHistogram:
+    key = (backend_class, phase)
+    if key not in _histograms:
+        with _histograms_lock:
+            _histograms.setdefault(key, LatencyHistogram())
+    return _histograms[key]
+
+
+@lru_cache
+def _get_executor():
+    return ThreadPoolExecutor(max_workers=get_setting('HEDGE_MAX_WORKERS'), thread_name_prefix='payment-hedge')
+
+
+def hedged(call, delay, timeout=None):
+    """
+    Call ``call`` and if it doesn't return in ``delay`` seconds call it again, Return the first successful result
+    Only use for idempotent requests
+    """
+    executor = _get_executor()
+    end = None if timeout is None else time.monotonic() + timeout
+
+    def submit():
+        # Each call runs in a copy of current context, So it sees deadline of caller
+        return executor.submit(contextvars.copy_context().run, call)
+
+    def time_left():
+        return None if end is None else max(end - time.monotonic(), 0)
+
+    pending = {submit()}
+    done, pending = wait(pending, timeout=delay if end is None else min(delay, time_left()))
+    if not done:
+        pending.add(submit())
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, timeout=time_left(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded("Deadline of request exceeded")
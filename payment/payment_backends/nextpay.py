@@ -1,22 +1,20 @@
 from django.utils.translation import gettext_lazy as _
 
-from .base import BaseBackend
+from .spec import BackendSpec
 from ..decorator import register
 from ..status import StatusChoices
 
-
-@register
-class NextpayBackend(BaseBackend):
-    name = _("Nextpay")
-
-    URLs = {
+NEXTPAY_SPEC = BackendSpec(
+    class_name='NextpayBackend',
+    module=__name__,
+    name=_("Nextpay"),
+    urls={
         'CREATE': "https://nextpay.org/nx/gateway/token",
         "VERIFY": "https://nextpay.org/nx/gateway/verify",
         "REFUND": "https://nextpay.org/nx/gateway/verify",
         "REDIRECT": "https://nextpay.org/nx/gateway/payment/{transaction.transaction_id}",
-    }
-
-    ERROR_MAPPING = {
+    },
+    status_mapping={
         0: StatusChoices.SUCCESSFUL,
         -1: StatusChoices.WAIT_FOR_PAY,
         -2: StatusChoices.CANCELED_BY_USER,
@@ -26,33 +24,26 @@ class NextpayBackend(BaseBackend):
         -91: StatusChoices.REFUND_FAILED,
         -92: StatusChoices.REFUND_FAILED,
         -93: StatusChoices.REFUND_FAILED_BY_LACK_OF_FUNDS,
-    }
-    TRANSLATE_DICTIONARY = BaseBackend.TRANSLATE_DICTIONARY | {
+    },
+    field_mapping={
         'shaparak_tracking_code': 'Shaparak_Ref_Id',
         'phone': 'customer_phone',
         'description': 'payer_desc'
-    }
-    REQUEST_FLAGS = [
+    },
+    request_flags=(
         'allowed_card',
         'auto_verify',
         'phone',
         'description',
-
-    ]
-
-    def get_verify_context(self):
-        return super().get_verify_context() | {
-            'amount': self.transaction.amount,
-            'currency': "IRR"
-        }
-
-    def get_refund_context(self):
-        return self.get_verify_context() | {'refund_request': 'yes_money_back'}
-
-    def get_headers(self):
-        return {
-            'User-Agent': 'PostmanRuntime/7.26.8',
-        }
-
-    def get_create_context(self, **kwargs):
-        return super().get_create_context(**kwargs) | {'currency': 'IRR'}
+    ),
+    headers={
+        'User-Agent': 'PostmanRuntime/7.26.8',
+    },
+    create_extra={'currency': 'IRR'},
+    verify_fields={'amount': 'amount'},
+    verify_extra={'currency': "IRR"},
+    refund_extra={'refund_request': 'yes_money_back'},
+    refund_includes_verify=True,
+)
+
+NextpayBackend = register(NEXTPAY_SPEC)
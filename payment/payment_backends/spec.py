@@ -0,0 +1,188 @@
+from dataclasses import dataclass, field
+
+from payment.models import COLD_FIELDS
+from payment.status import StatusChoices
+from .base import BaseBackend
+
+__all__ = ['BackendSpec', 'compile_spec']
+
+
+@dataclass(frozen=True, eq=False)
+class BackendSpec:
+    """
+    Declarative definition of a pay portal backend
+
+    ``field_mapping`` translate flags to pay portal keys (Like TRANSLATE_DICTIONARY),
+    ``status_mapping`` map pay portal codes to StatusChoices (Like ERROR_MAPPING) and
+    ``verify_fields`` map pay portal keys to transaction attributes that send in verify request
+    """
+    class_name: str
+    module: str
+    name: str
+    urls: dict
+    status_mapping: dict
+    field_mapping: dict = field(default_factory=dict)
+    request_flags: tuple = tuple(BaseBackend.REQUEST_FLAGS)
+    receiving_flags: tuple = tuple(BaseBackend.RECEIVING_FLAGS)
+    # Place of API key, 'body' send it as ``api_key_name`` key of data and 'header' as ``api_key_name`` header
+    api_key_name: str = BaseBackend.API_KEY_NAME
+    api_key_location: str = 'body'
+    transaction_id_key: str = BaseBackend.TRANSACTION_ID_KEY_NAME
+    # Status read from first of these fields that has a truthy value
+    status_fields: tuple = (BaseBackend.STATUS_FIELD,)
+    headers: dict = field(default_factory=dict)
+    create_extra: dict = field(default_factory=dict)
+    verify_fields: dict = field(default_factory=dict)
+    verify_extra: dict = field(default_factory=dict)
+    refund_extra: dict = field(default_factory=dict)
+    refund_includes_verify: bool = False
+    verify_expiry: object = None
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Create spec from a plain dict (e.g. loaded from JSON or YAML)
+        Status mapping keys may be strings of codes and values may be names of StatusChoices
+        """
+        data = dict(data)
+        data['status_mapping'] = {
+            int(code) if isinstance(code, str) and code.lstrip('-').isdigit() else code:
+                StatusChoices[status] if isinstance(status, str) else StatusChoices(status)
+            for code, status in data['status_mapping'].items()
+        }
+        for key in ('request_flags', 'receiving_flags', 'status_fields'):
+            if key in data:
+                data[key] = tuple(data[key])
+        return cls(**data)
+
+
+def _compile_get_status(status_fields):
+    if len(status_fields) == 1:
+        status_field, = status_fields
+
+        def get_status(self, data: dict):
+            return data.get(status_field)
+    else:
+        *first_fields, last_field = status_fields
+
+        def get_status(self, data: dict):
+            for status_field in first_fields:
+                if value := data.get(status_field):
+                    return value
+            return data.get(last_field)
+    return get_status
+
+
+def compile_spec(spec: BackendSpec):
+    """
+    Build a BaseBackend subclass from spec
+    Every translation and lookup that base backend does on each request is computed here once
+    """
+    if spec.api_key_location not in ('body', 'header'):
+        raise ValueError(f"Invalid api_key_location {spec.api_key_location!r}")
+
+    translate_dictionary = BaseBackend.TRANSLATE_DICTIONARY | spec.field_mapping
+
+    def translate(flag):
+        return translate_dictionary.get(flag) or flag
+
+    # (flag, translated flag, getter name)
+    request_flags = tuple((flag, translate(flag), 'get_' + flag) for flag in spec.request_flags)
+    # (flag, translated flag, is cold field)
+    receiving_flags = tuple((flag, translate(flag), flag in COLD_FIELDS) for flag in spec.receiving_flags)
+    create_extra = dict(spec.create_extra)
+    verify_fields = tuple(spec.verify_fields.items())
+    verify_extra = dict(spec.verify_extra)
+    refund_extra = dict(spec.refund_extra)
+    refund_includes_verify = spec.refund_includes_verify
+    api_key_name = spec.api_key_name
+    transaction_id_key = spec.transaction_id_key
+    static_headers = dict(spec.headers)
+    auth_in_header = spec.api_key_location == 'header'
+
+    def get_create_context(self, **kwargs):
+        context = {}
+        transaction = self.transaction
+        user = transaction.user
+        for flag, translated_flag, getter in request_flags:
+            value = None
+            if flag in kwargs:
+                value = kwargs[flag]
+            elif hasattr(transaction, flag):
+                value = getattr(transaction, flag)
+            elif user:
+                if hasattr(user, flag):
+                    value = getattr(user, flag)
+                elif callable(getattr(user, getter, None)):
+                    value = getattr(user, getter)()
+            if value is not None:
+                context[translated_flag] = value
+        if create_extra:
+            context.update(create_extra)
+        return context
+
+    def apply_to_transaction(self, data: dict):
+        transaction = self.transaction
+        for flag, translated_flag, is_cold in receiving_flags:
+            if translated_flag in data:
+                try:
+                    if is_cold:
+                        transaction.set_cold(flag, data[translated_flag])
+                    else:
+                        setattr(transaction, flag, data[translated_flag])
+                except AttributeError:
+                    pass
+
+    if auth_in_header:
+        def get_auth_context(self):
+            return {}
+
+        def get_headers(self):
+            return static_headers | {api_key_name: str(self.transaction.portal.api_key)}
+    else:
+        def get_auth_context(self):
+            return {api_key_name: str(self.transaction.portal.api_key)}
+
+        def get_headers(self):
+            return dict(static_headers) if static_headers else None
+
+    def get_verify_context(self):
+        transaction = self.transaction
+        context = get_auth_context(self)
+        context[transaction_id_key] = transaction.transaction_id
+        for key, attribute in verify_fields:
+            context[key] = getattr(transaction, attribute)
+        if verify_extra:
+            context.update(verify_extra)
+        return context
+
+    def get_refund_context(self):
+        context = get_verify_context(self) if refund_includes_verify else {}
+        if refund_extra:
+            context.update(refund_extra)
+        return context
+
+    attrs = {
+        '__module__': spec.module,
+        '__qualname__': spec.class_name,
+        '__doc__': f"Backend compiled from declarative spec of {spec.class_name}",
+        'spec': spec,
+        'name': spec.name,
+        'URLS': dict(spec.urls),
+        'ERROR_MAPPING': dict(spec.status_mapping),
+        'TRANSLATE_DICTIONARY': translate_dictionary,
+        'REQUEST_FLAGS': list(spec.request_flags),
+        'RECEIVING_FLAGS': list(spec.receiving_flags),
+        'API_KEY_NAME': api_key_name,
+        'TRANSACTION_ID_KEY_NAME': transaction_id_key,
+        'STATUS_FIELD': spec.status_fields[0],
+        'VERIFY_EXPIRY': spec.verify_expiry,
+        'get_status': _compile_get_status(spec.status_fields),
+        'get_create_context': get_create_context,
+        'apply_to_transaction': apply_to_transaction,
+        'get_auth_context': get_auth_context,
+        'get_headers': get_headers,
+        'get_verify_context': get_verify_context,
+        'get_refund_context': get_refund_context,
+    }
+    return type(spec.class_name, (BaseBackend,), attrs)
@@ -0,0 +1,158 @@
+import gzip
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from requests import Response
+
+from payment.conf import get_setting
+
+__all__ = ['Recorder', 'get_recorder', 'ReplayTransport', 'get_replay', 'replay', 'load_records', 'redact',
+           'get_backend_path']
+
+REDACTED = '***'
+
+_replay = ContextVar('payment_replay', default=None)
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_backend_path(backend_class):
+    return f'{backend_class.__module__}.{backend_class.__qualname__}'
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def redact(data, keys=None):
+    """
+    Return copy of JSON data that values of secret keys (PAYMENT_TRAFFIC_REDACT_KEYS, case insensitive) are masked
+    """
+    if keys is None:
+        keys = {key.lower() for key in get_setting('TRAFFIC_REDACT_KEYS')}
+    if isinstance(data, dict):
+        return {key: REDACTED if key.lower() in keys else redact(value, keys) for key, value in data.items()}
+    if isinstance(data, list):
+        return [redact(value, keys) for value in data]
+    return data
+
+
+class Recorder:
+    """
+    Append request/response pairs of pay portals to a JSON lines file (gzip when path ends with ``.gz``)
+    Each line: ``{"at", "backend", "phase", "request", "status", "response", "latency"}``, Secrets are redacted
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, backend_class, phase, request_json, response: Response, latency):
+        # API key and personal data of users in keys of backend are always redacted
+        keys = {key.lower() for key in [*get_setting('TRAFFIC_REDACT_KEYS'), *backend_class.get_redact_keys()]}
+        try:
+            body = redact(response.json(), keys)
+        except ValueError:
+            body = None
+        line = json.dumps({
+            'at': time.time(),
+            'backend': get_backend_path(backend_class),
+            'phase': phase,
+            'request': redact(request_json, keys),
+            'status': response.status_code,
+            'response': body,
+            'latency': round(latency, 6),
+        }, separators=(',', ':'))
+        with self._lock, _open(self.path, 'a') as file:
+            file.write(line + '\n')
+
+
+def get_recorder():
+    """
+    Return recorder of PAYMENT_TRAFFIC_RECORD_PATH or None when recording is off
+    """
+    path = get_setting('TRAFFIC_RECORD_PATH')
+    if not path:
+        return None
+    with _recorders_lock:
+        if path not in _recorders:
+            _recorders[path] = Recorder(path)
+        return _recorders[path]
+
+
+def load_records(path):
+    with _open(path, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class ReplayTransport:
+    """
+    Serve recorded responses instead of sending requests to pay portals
+    Responses of each (backend, phase) are served in recorded order and repeated when exhausted
+    ``speed`` scales recorded latency (2 is twice as fast), None serves responses without delay
+    Transaction IDs of create responses are made unique so replayed transactions can be saved
+    """
+
+    def __init__(self, records, speed=1.0):
+        self.speed = speed
+        self._responses = defaultdict(list)
+        for record in records:
+            self._responses[record['backend'], record['phase']].append(record)
+        self._cycles = {key: itertools.cycle(records) for key, records in self._responses.items()}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, speed=1.0):
+        return cls(load_records(path), speed)
+
+    def get_backends(self):
+        return {backend for backend, phase in self._responses}
+
+    def count(self, backend_class, phase):
+        return len(self._responses.get((get_backend_path(backend_class), phase), ()))
+
+    def get_phases(self, backend_class):
+        backend = get_backend_path(backend_class)
+        return {phase for path, phase in self._responses if path == backend}
+
+    def post(self, backend, phase, url, **kwargs) -> Response:
+        key = (get_backend_path(backend.__class__), phase)
+        if key not in self._cycles:
+            raise LookupError(f"No recorded {phase} response of {key[0]}")
+        with self._lock:
+            record = next(self._cycles[key])
+            number = next(self._counter)
+        if self.speed:
+            time.sleep(record['latency'] / self.speed)
+        body = record['response']
+        if phase == 'CREATE' and isinstance(body, dict) and backend.TRANSACTION_ID_KEY_NAME in body:
+            body = {**body, backend.TRANSACTION_ID_KEY_NAME: f"replay-{number}-{body[backend.TRANSACTION_ID_KEY_NAME]}"}
+        response = Response()
+        response.status_code = record['status']
+        response.url = url
+        response._content = b'' if body is None else json.dumps(body).encode()
+        return response
+
+
+def get_replay():
+    return _replay.get()
+
+
+@contextmanager
+def replay(transport: ReplayTransport):
+    """
+    Serve every pay portal request of block (and threads started with its context) from transport
+    """
+    token = _replay.set(transport)
+    try:
+        yield transport
+    finally:
+        _replay.reset(token)
@@ -2,26 +2,22 @@ from django.utils.translation import gettext_lazy as _
 
 from payment import status
 from payment.decorator import register
-from payment.payment_backends import BaseBackend
+from payment.payment_backends.spec import BackendSpec
 
-
-@register
-class ZibalBackend(BaseBackend):
-    name = _('Zibal')
-    API_KEY_NAME = 'merchant'
-    TRANSACTION_ID_KEY_NAME = "trackId"
-
-    def get_status(self, data: dict):
-        return data.get('status') or data.get('result')
-
-    URLS = {
+ZIBAL_SPEC = BackendSpec(
+    class_name='ZibalBackend',
+    module=__name__,
+    name=_('Zibal'),
+    api_key_name='merchant',
+    transaction_id_key="trackId",
+    status_fields=('status', 'result'),
+    urls={
         "CREATE": "https://gateway.zibal.ir/request/lazy",
         "AUTO_VERIFY_CREATE": "https://gateway.zibal.ir/v1/request",
         "VERIFY": "https://gateway.zibal.ir/v1/verify",
         "REDIRECT": "https://gateway.zibal.ir/start/{transaction.transaction_id}"
-    }
-
-    ERROR_MAPPING = {
+    },
+    status_mapping={
         -1: status.StatusChoices.WAIT_FOR_PAY,
         1: status.StatusChoices.SUCCESSFUL,
         2: status.StatusChoices.WAIT_FOR_BANK,
@@ -37,9 +33,8 @@ class ZibalBackend(BaseBackend):
         202: status.StatusChoices.FAILED,
         203: status.StatusChoices.TRANSITION_ID_INVALID,
         114: status.StatusChoices.CANCELED
-    }
-
-    TRANSLATE_DICTIONARY = BaseBackend.TRANSLATE_DICTIONARY | {
+    },
+    field_mapping={
         'phone': 'mobile',
         'allowed_card': 'allowedCards',
         'national_code': 'nationalCode',
@@ -48,4 +43,7 @@ class ZibalBackend(BaseBackend):
         'shaparak_tracking_code': 'refNumber',
         'callback_uri': 'callbackUrl',
         'card_holder': 'cardNumber'
-    }
+    },
+)
+
+ZibalBackend = register(ZIBAL_SPEC)
@@ -0,0 +1,269 @@
+import cProfile
+import hmac
+import json
+import logging
+import marshal
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import connections
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from payment.conf import get_setting
+
+__all__ = ['Profile', 'BaseSink', 'FileSink', 'LoggingSink', 'get_sink', 'get_profile', 'profiling', 'profiled',
+           'profile_request', 'count_queries']
+
+logger = logging.getLogger(__name__)
+
+_profile = ContextVar('payment_profile', default=None)
+
+# Header that forces profiling of an API request, Its value must be equal to PAYMENT_PROFILE_TOKEN
+PROFILE_HEADER = 'X-Payment-Profile'
+
+
+class Profile:
+    """
+    Captured profile of a request or backend call
+    ``timings`` maps ``"<kind>:<name>"`` (section, signal, query or gateway) to ``[count, seconds]``
+    """
+    SLOW_QUERIES = 10
+
+    def __init__(self, name, id=None, started_at=None, duration=0.0, timings=None, slow_queries=None, memory=None,
+                 stats=None):
+        self.name = name
+        self.id = id or uuid.uuid4().hex
+        self.started_at = started_at or now()
+        self.duration = duration
+        self.timings = defaultdict(lambda: [0, 0.0], timings or {})
+        self.slow_queries = slow_queries or []
+        self.memory = memory
+        # cProfile stats in pstats format, ``pstats.Stats(profile)`` loads them
+        self.stats = stats or {}
+
+    def __str__(self):
+        return f"{self.name} {self.duration * 1000:.1f}ms"
+
+    @contextmanager
+    def timer(self, kind, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(kind, name, time.perf_counter() - started)
+
+    def add_timing(self, kind, name, seconds):
+        timing = self.timings[f'{kind}:{name}']
+        timing[0] += 1
+        timing[1] += seconds
+
+    def execute_wrapper(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                with self.timer('query', alias):
+                    return execute(sql, params, many, context)
+            finally:
+                self.add_query(time.perf_counter() - started, sql)
+        return wrapper
+
+    def add_query(self, duration, sql):
+        self.slow_queries.append((duration, sql[:500]))
+        if len(self.slow_queries) > self.SLOW_QUERIES:
+            self.slow_queries.sort(reverse=True)
+            self.slow_queries.pop()
+
+    def create_stats(self):
+        # Lets pstats.Stats load profile
+        pass
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'id': self.id,
+            'started_at': self.started_at.isoformat(),
+            'duration': self.duration,
+            'timings': dict(self.timings),
+            'slow_queries': sorted(self.slow_queries, reverse=True),
+            'memory': self.memory,
+        }
+
+
+class BaseSink:
+    def write(self, profile: Profile):
+        raise NotImplementedError
+
+    def read(self):
+        """
+        Return iterable of captured profiles, Used by ``payment_profile_report`` command
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} can't be read")
+
+
+class FileSink(BaseSink):
+    """
+    Write each profile to PAYMENT_PROFILE_DIRECTORY as ``<id>.json`` and ``<id>.prof``
+    ``.prof`` files are regular cProfile dumps and can be opened by any pstats viewer
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or get_setting('PROFILE_DIRECTORY') or os.path.join(tempfile.gettempdir(),
+                                                                                     'payment-profiles')
+
+    def write(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{profile.started_at:%Y%m%d%H%M%S}-{profile.id}")
+        if profile.stats:
+            with open(f'{path}.prof', 'wb') as file:
+                marshal.dump(profile.stats, file)
+        with open(f'{path}.json', 'w') as file:
+            json.dump(profile.to_dict(), file)
+
+    def read(self):
+        if not os.path.isdir(self.directory):
+            return
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, filename[:-len('.json')])
+            with open(f'{path}.json') as file:
+                data = json.load(file)
+            data['started_at'] = None
+            if os.path.exists(f'{path}.prof'):
+                with open(f'{path}.prof', 'rb') as file:
+                    data['stats'] = marshal.load(file)
+            data['slow_queries'] = [tuple(query) for query in data['slow_queries']]
+            yield Profile(**data)
+
+
+class LoggingSink(BaseSink):
+    """
+    Log summary of each profile, Function stats are dropped
+    """
+
+    def write(self, profile):
+        logger.info("Profile %s: %s", profile, json.dumps(profile.to_dict()))
+
+
+def get_sink() -> BaseSink:
+    return import_string(get_setting('PROFILE_SINK'))()
+
+
+def get_profile():
+    """
+    Return profile of current context or None when it is not profiled
+    """
+    return _profile.get()
+
+
+def is_sampled():
+    rate = get_setting('PROFILE_SAMPLE_RATE')
+    return rate > 0 and random.random() < rate
+
+
+@contextmanager
+def profiling(name, sampled=None):
+    """
+    Profile block and write the profile to sink, Block is profiled when ``sampled`` or by PAYMENT_PROFILE_SAMPLE_RATE
+    Inside a profiled block only wall time of block is added to outer profile as a section
+    """
+    current = _profile.get()
+    if current is not None:
+        with current.timer('section', name):
+            yield current
+        return
+    if not (is_sampled() if sampled is None else sampled):
+        yield None
+        return
+
+    profile = Profile(name)
+    token = _profile.set(profile)
+    profiler = cProfile.Profile()
+    memory = get_setting('PROFILE_TRACEMALLOC') and not tracemalloc.is_tracing()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile.execute_wrapper(connection.alias)))
+        if memory:
+            tracemalloc.start()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread
+            profiler = None
+        started = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.duration = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                profile.stats = profiler.stats
+            if memory:
+                profile.memory = get_memory_usage(tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            _profile.reset(token)
+    try:
+        get_sink().write(profile)
+    except Exception as e:
+        logger.warning("Writing profile failed: %s", e, exc_info=True)
+
+
+def get_memory_usage(snapshot, peak, limit=10):
+    return {
+        'peak': peak,
+        'top': [(str(stat.traceback), stat.size, stat.count) for stat in snapshot.statistics('lineno')[:limit]],
+    }
+
+
+def profiled(name=None):
+    """
+    Decorator version of ``profiling``, Name of profile is qualified name of function by default
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiling(name or function.__qualname__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_request(request, name):
+    """
+    Profile an API request when sampled or when it has ``X-Payment-Profile`` header equal to PAYMENT_PROFILE_TOKEN
+    """
+    token = get_setting('PROFILE_TOKEN')
+    value = request.headers.get(PROFILE_HEADER)
+    forced = bool(token and value and hmac.compare_digest(value, token))
+    return profiling(name, sampled=True if forced else None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count queries of block on every database, Yield counter that its ``count`` is number of queries
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.db import transaction as db_transaction
+from django.db.models import Sum
+from django.utils.timezone import now
+
+from payment import signals
+from payment.conf import get_setting
+from payment.events import buffer_events, record_event
+from payment.models import EventPhaseChoices, Refund, RefundBatch, RefundStatusChoices, Transaction
+from payment.registry import linked_registry
+from payment.sharding import get_transaction_databases, is_sharded, shard_for_id
+from payment.state_machine import PREDECESSORS, bulk_transition
+from payment.status import StatusChoices
+from payment.summary import apply_partial_refunds
+
+__all__ = ['queue_refunds', 'RefundProcessor', 'RefundProgress']
+
+logger = logging.getLogger(__name__)
+
+# Transactions that can be refunded
+REFUNDABLE_STATUSES = PREDECESSORS[StatusChoices.REFUNDED] - {StatusChoices.REFUNDED}
+
+
+def queue_refunds(transactions, amount=None, name='', batch=None):
+    """
+    Add refunds of transactions to ledger in a batch and return the batch
+    Refund whole remaining amount of each transaction when amount is None, Transactions that are not refundable or
+    don't have enough remaining amount are ignored
+    """
+    batch = batch or RefundBatch.objects.create(name=name)
+    pks = [getattr(obj, 'pk', obj) for obj in transactions]
+    for database in get_transaction_databases():
+        # Refunds are kept on shard of their transaction
+        database_pks = [pk for pk in pks if shard_for_id(pk) == database] if is_sharded() else pks
+        if database_pks:
+            _queue_refunds(batch, database_pks, amount, database)
+    return batch
+
+
+def _queue_refunds(batch, pks, amount, database):
+    chunk_size = get_setting('REFUND_CHUNK_SIZE')
+    queryset = Transaction.objects.using(database).filter(pk__in=pks, status__in=REFUNDABLE_STATUSES).order_by('pk')
+    last_pk = 0
+    while chunk := list(queryset.filter(pk__gt=last_pk).values_list('pk', 'amount')[:chunk_size]):
+        last_pk = chunk[-1][0]
+        reserved = dict(Refund.objects.using(database).reserved().filter(transaction_id__in=[pk for pk, _ in chunk])
+                        .values_list('transaction_id').annotate(total=Sum('amount')))
+        refunds = []
+        for pk, transaction_amount in chunk:
+            remaining = transaction_amount - reserved.get(pk, 0)
+            refund_amount = remaining if amount is None else amount
+            if 0 < refund_amount <= remaining:
+                refunds.append(Refund(batch_id=batch.pk, transaction_id=pk, amount=refund_amount))
+        Refund.objects.using(database).bulk_create(refunds)
+
+
+@dataclass
+class RefundProgress:
+    total: int
+    processed: int = 0
+    counts: Counter = field(default_factory=Counter)
+    amount: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        counts = ', '.join(f"{RefundStatusChoices(status).label}: {count}" for status, count in self.counts.items())
+        return f"{self.processed}/{self.total} refunds ({counts}) {self.rate:.1f}/s"
+
+
+class RefundProcessor:
+    """
+    Execute pending refunds of a batch concurrently, At most ``portal_concurrency`` requests to each pay portal run
+    together. Refunds are claimed in chunks (PENDING -> PROCESSING) and results written back in bulk, So a crashed run
+    resumes from its last chunk. Refunds left in PROCESSING (interrupted runs and requests that raised) may have
+    reached the pay portal, They keep their amount reserved and only retried by ``retry_in_flight``.
+    Refunds of each shard are processed on their shard.
+    """
+
+    def __init__(self, batch, portal_concurrency=None, chunk_size=None, dry_run=False, progress=None):
+        self.batch = batch
+        self.portal_concurrency = portal_concurrency or get_setting('REFUND_PORTAL_CONCURRENCY')
+        self.chunk_size = chunk_size or get_setting('REFUND_CHUNK_SIZE')
+        self.dry_run = dry_run
+        self.progress_callback = progress
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+        self.databases = get_transaction_databases()
+
+    def get_queryset(self, database=None):
+        return Refund.objects.using(database).filter(batch_id=self.batch.pk)
+
+    def count(self, *statuses):
+        return sum(self.get_queryset(database).filter(status__in=statuses).count() for database in self.databases)
+
+    def retry_in_flight(self):
+        return sum(self.get_queryset(database).filter(status=RefundStatusChoices.PROCESSING).update(
+            status=RefundStatusChoices.PENDING) for database in self.databases)
+
+    def claim(self, database=None):
+        with db_transaction.atomic(using=database):
+            pks = list(self.get_queryset(database).select_for_update(skip_locked=True)
+                       .filter(status=RefundStatusChoices.PENDING).order_by('pk')
+                       .values_list('pk', flat=True)[:self.chunk_size])
+            if pks:
+                Refund.objects.using(database).filter(pk__in=pks).update(status=RefundStatusChoices.PROCESSING)
+        return list(Refund.objects.using(database).filter(pk__in=pks).select_related('transaction__portal'))
+
+    def _get_semaphore(self, portal_id):
+        with self._semaphores_lock:
+            if portal_id not in self._semaphores:
+                self._semaphores[portal_id] = threading.BoundedSemaphore(self.portal_concurrency)
+            return self._semaphores[portal_id]
+
+    def execute(self, refund):
+        """
+        Send refund request in a worker thread, Return (refund, backend, response, latency)
+        """
+        backend = refund.transaction.backend_controller
+        with self._get_semaphore(refund.transaction.portal_id):
+            started = time.monotonic()
+            response = backend.send_refund_request(amount=None if refund.is_full else refund.amount)
+            return refund, backend, response, time.monotonic() - started
+
+    def apply_result(self, refund, backend, response, latency):
+        try:
+            code = backend.get_status(response.json())
+        except ValueError:
+            code = None
+        status = backend.ERROR_MAPPING.get(code, StatusChoices.REFUND_FAILED) if response.ok else \
+            StatusChoices.REFUND_FAILED
+        refund.code = None if code is None else str(code)[:32]
+        refund.status = RefundStatusChoices.SUCCESSFUL if status == StatusChoices.REFUNDED else \
+            RefundStatusChoices.FAILED
+        refund.processed_at = now()
+        refund.transaction_status = status
+        record_event(refund.transaction, EventPhaseChoices.REFUND, code=code, status=status,
+                     http_status=response.status_code, latency=latency * 1000)
+
+    def process_chunk(self, refunds, executor, database=None):
+        supported = []
+        for refund in refunds:
+            if refund.transaction.backend_controller.support_refund():
+                supported.append(refund)
+            else:
+                refund.status = RefundStatusChoices.SKIPPED
+                refund.processed_at = now()
+
+        with buffer_events():
+            for future in [executor.submit(self.execute, refund) for refund in supported]:
+                try:
+                    self.apply_result(*future.result())
+                except Exception as e:
+                    logger.warning("Refund failed: %s", e, exc_info=True)
+        # Refunds that their request raised stay in PROCESSING, Result of pay portal is unknown
+
+        Refund.objects.using(database).bulk_update(refunds, ['status', 'code', 'processed_at'])
+        self.write_transactions(refunds, database)
+
+    def write_transactions(self, refunds, database=None):
+        """
+        Move transactions of full refunds, And of partial refunds that complete refunded amount of their transaction,
+        to their refund status with one UPDATE per status
+        post_refund_batch is sent once for moved transactions of chunk
+        """
+        by_status = {}
+        claimed = {}
+        partial = {}
+        # transaction -> amount of its partial refunds in chunk
+        partial_amounts = Counter()
+        # transaction -> amount of its partial refunds in previous chunks
+        previous_amounts = {}
+        for refund in refunds:
+            if getattr(refund, 'transaction_status', None) is None:
+                continue
+            if refund.is_full:
+                by_status.setdefault(refund.transaction_status, []).append(refund.transaction_id)
+                claimed[refund.transaction_id] = refund.transaction
+            elif refund.status == RefundStatusChoices.SUCCESSFUL:
+                partial[refund.transaction_id] = refund.transaction
+                partial_amounts[refund.transaction_id] += refund.amount
+        if partial:
+            refunded = (Refund.objects.using(database).filter(transaction_id__in=partial,
+                                                              status=RefundStatusChoices.SUCCESSFUL)
+                        .values_list('transaction_id').annotate(total=Sum('amount')))
+            for pk, total in refunded:
+                if total >= partial[pk].amount:
+                    by_status.setdefault(StatusChoices.REFUNDED, []).append(pk)
+                    claimed[pk] = partial[pk]
+                    previous_amounts[pk] = total - partial_amounts[pk]
+        moved = []
+        for status, pks in by_status.items():
+            for transaction in bulk_transition(Transaction.objects.using(database).filter(pk__in=pks), status):
+                transaction.portal = claimed[transaction.pk].portal
+                if status == StatusChoices.REFUNDED:
+                    linked_registry.dispatch(transaction, 'refunded')
+                moved.append(transaction)
+        self.write_summaries(partial, partial_amounts, previous_amounts, {transaction.pk for transaction in moved})
+        signals.post_refund_batch.send_by_backend(
+            moved, [(claimed[transaction.pk].status, transaction.status) for transaction in moved], {'response': None})
+
+    def write_summaries(self, partial, partial_amounts, previous_amounts, moved):
+        """
+        Move amounts of successful partial refunds to refunded total of summaries
+        Transition of a refunded transaction moves its whole amount, So amounts of its previous partial refunds that
+        are already moved are taken back
+        """
+        amounts = Counter()
+        for pk, transaction in partial.items():
+            if pk in moved:
+                amounts[transaction.user_id] -= previous_amounts[pk]
+            else:
+                amounts[transaction.user_id] += partial_amounts[pk]
+        apply_partial_refunds(amounts)
+
+    def report(self, progress, refunds):
+        progress.processed += len(refunds)
+        for refund in refunds:
+            progress.counts[refund.status] += 1
+            if refund.status == RefundStatusChoices.SUCCESSFUL:
+                progress.amount += refund.amount
+        if self.progress_callback:
+            self.progress_callback(progress)
+
+    def dry_run_report(self):
+        """
+        Report pending refunds as if processed, Without any request or write
+        """
+        progress = RefundProgress(total=self.count(RefundStatusChoices.PENDING))
+        for database in self.databases:
+            pending = self.get_queryset(database).filter(status=RefundStatusChoices.PENDING).select_related(
+                'transaction__portal')
+            for refund in pending.iterator(chunk_size=self.chunk_size):
+                supported = refund.transaction.backend_controller.support_refund()
+                refund.status = RefundStatusChoices.SUCCESSFUL if supported else RefundStatusChoices.SKIPPED
+                self.report(progress, [refund])
+        return progress
+
+    def run(self):
+        if self.dry_run:
+            return self.dry_run_report()
+        progress = RefundProgress(total=self.count(RefundStatusChoices.PENDING))
+        with ThreadPoolExecutor(max_workers=self.portal_concurrency * 4,
+                                thread_name_prefix='payment-refund') as executor:
+            for database in self.databases:
+                while refunds := self.claim(database):
+                    self.process_chunk(refunds, executor, database)
+                    self.report(progress, refunds)
+        if not self.count(RefundStatusChoices.PENDING, RefundStatusChoices.PROCESSING):
+            RefundBatch.objects.filter(pk=self.batch.pk).update(finished_at=now())
+        return progress
@@ -1,14 +1,19 @@
+import logging
+
 from django.utils.module_loading import import_string
 
-__all__ = ['PayPortalBackendRegistry', 'registry']
+__all__ = ['PayPortalBackendRegistry', 'registry', 'LinkedModelRegistry', 'linked_registry']
 
 from payment.exceptions import AlreadyRegistered, NotRegistered
 
+logger = logging.getLogger(__name__)
+
 
 class PayPortalBackendRegistry:
     def __init__(self):
         self._registry = {}
         self._choices = {}
+        self._compiled = {}
 
     def register(self, backend_class):
         """
@@ -23,6 +28,24 @@ class PayPortalBackendRegistry:
         self._registry[backend_class.__name__] = backend_name
         self._choices[backend_name] = backend_class.name
 
+    def compile(self, spec):
+        """
+        Compile a declarative BackendSpec to a backend class, Each spec compiled only once
+        """
+        from payment.payment_backends.spec import compile_spec
+
+        if spec not in self._compiled:
+            self._compiled[spec] = compile_spec(spec)
+        return self._compiled[spec]
+
+    def register_spec(self, spec):
+        """
+        Compile and register a declarative BackendSpec and return compiled backend class
+        """
+        backend_class = self.compile(spec)
+        self.register(backend_class)
+        return backend_class
+
     def unregister(self, backend_class):
         """
         Unregister a payment backend from the registry by using the class name as the key
@@ -62,3 +85,63 @@ class PayPortalBackendRegistry:
 
 # Create an instance of the registry class
 registry = PayPortalBackendRegistry()
+
+
+class LinkedModelRegistry:
+    """
+    Registry of payment-aware models (models that transactions linked to) and their transaction handlers
+    Handlers are resolved once when apps are ready, so dispatching a handler is a dict lookup
+    """
+    HANDLER_NAMES = {
+        'successful': 'on_transaction_successful',
+        'failed': 'on_transaction_failed',
+        'refunded': 'on_transaction_refunded',
+    }
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, model, **handlers):
+        """
+        Register handlers of model, Keys of handlers are keys of HANDLER_NAMES
+        """
+        self._handlers[model] = {event: handler for event, handler in handlers.items() if callable(handler)}
+
+    def autodiscover(self):
+        """
+        Register every installed model that defines a method of HANDLER_NAMES
+        """
+        from django.apps import apps
+
+        for model in apps.get_models():
+            if model in self._handlers:
+                continue
+            handlers = {event: getattr(model, name) for event, name in self.HANDLER_NAMES.items()
+                        if callable(getattr(model, name, None))}
+            if handlers:
+                self.register(model, **handlers)
+
+    def get_handler(self, transaction, event):
+        if transaction.linked_contenttype_id is None:
+            return None
+        from django.contrib.contenttypes.models import ContentType
+
+        # get_for_id is cached by ContentType manager
+        model = ContentType.objects.get_for_id(transaction.linked_contenttype_id).model_class()
+        return self._handlers.get(model, {}).get(event)
+
+    def dispatch(self, transaction, event, request=None, **kwargs):
+        """
+        Call handler of event on linked model of transaction, Errors of handlers are logged
+        Handlers always receive ``request``, None when transaction is not handled in a request (e.g. worker)
+        """
+        handler = self.get_handler(transaction, event)
+        if handler is None:
+            return
+        try:
+            handler(transaction=transaction, request=request, **kwargs)
+        except Exception as e:
+            logger.warning(str(e), exc_info=True)
+
+
+linked_registry = LinkedModelRegistry()
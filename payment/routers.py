@@ -0,0 +1,96 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from payment.conf import get_cache, get_setting
+
+__all__ = ['PaymentRouter', 'replica_reads', 'pin_transaction', 'is_pinned', 'get_primary_database',
+           'get_replica_database', 'get_read_database']
+
+_replica_reads = ContextVar('payment_replica_reads', default=False)
+
+
+def get_primary_database():
+    return get_setting('PRIMARY_DATABASE')
+
+
+def get_replica_database():
+    replicas = get_setting('REPLICA_DATABASES')
+    if not replicas:
+        return get_primary_database()
+    return random.choice(replicas)
+
+
+def _pin_key(pk):
+    return f"payment:pin:{pk}"
+
+
+def pin_transaction(pk):
+    """
+    Read transaction from primary database for PAYMENT_PIN_SECONDS after a write, so replica lag never hides it
+    """
+    if pk is not None:
+        get_cache().set(_pin_key(pk), True, timeout=get_setting('PIN_SECONDS'))
+
+
+def is_pinned(pk):
+    return pk is not None and get_cache().get(_pin_key(pk)) is not None
+
+
+def get_read_database(pk=None):
+    """
+    Return database that a read can go to, Reads of a recently written transaction go to primary
+    """
+    if pk is not None and is_pinned(pk):
+        return get_primary_database()
+    return get_replica_database()
+
+
+@contextmanager
+def replica_reads():
+    """
+    Send reads of payment models in this block to replicas (Used for list, export and analytics)
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PaymentRouter:
+    """
+    Database router of payment app, Add 'payment.routers.PaymentRouter' to settings.DATABASE_ROUTERS
+
+    All writes and default reads go to PAYMENT_PRIMARY_DATABASE and reads inside ``replica_reads()`` go to one of
+    PAYMENT_REPLICA_DATABASES unless the instance is pinned to primary
+    """
+    app_label = 'payment'
+
+    def _is_payment_model(self, model):
+        return model._meta.app_label == self.app_label
+
+    def db_for_read(self, model, **hints):
+        if not self._is_payment_model(model):
+            return None
+        if _replica_reads.get():
+            instance = hints.get('instance')
+            if instance is None or not is_pinned(instance.pk):
+                return get_replica_database()
+        return get_primary_database()
+
+    def db_for_write(self, model, **hints):
+        if not self._is_payment_model(model):
+            return None
+        return get_primary_database()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {get_primary_database(), *get_setting('REPLICA_DATABASES')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label != self.app_label:
+            return None
+        return db == get_primary_database()
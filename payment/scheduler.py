@@ -0,0 +1,115 @@
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, transaction as db_transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from payment import signals
+from payment.conf import get_setting
+from payment.events import buffer_events
+
+__all__ = ['get_backoff', 'VerifyScheduler']
+
+logger = logging.getLogger(__name__)
+
+
+def get_backoff(attempts: int) -> timedelta:
+    """
+    Return delay before next verify of a transaction that verified ``attempts`` times
+    Delay doubles on each attempt up to PAYMENT_VERIFY_BACKOFF_MAX and randomly jittered,
+    So transactions created together don't come due together
+    """
+    delay = min(get_setting('VERIFY_BACKOFF_BASE') * (2 ** min(attempts, 20)), get_setting('VERIFY_BACKOFF_MAX'))
+    jitter = delay.total_seconds() * get_setting('VERIFY_BACKOFF_JITTER')
+    return delay + timedelta(seconds=random.uniform(-jitter, jitter))
+
+
+class VerifyScheduler:
+    """
+    Long-lived worker that verify due pending transactions
+
+    Each round claims a batch of due transactions with ``SELECT ... FOR UPDATE SKIP LOCKED`` and moves their
+    next verify time forward by a lease, so several workers can run together without verifying a transaction twice.
+    Verifies are spread evenly in time by ``rate`` (verifies per second).
+    """
+
+    def __init__(self, batch_size=None, rate=None, lease=None, using=DEFAULT_DB_ALIAS):
+        self.batch_size = batch_size or get_setting('VERIFY_WORKER_BATCH_SIZE')
+        self.rate = rate or get_setting('VERIFY_WORKER_RATE')
+        self.lease = lease or get_setting('VERIFY_WORKER_LEASE')
+        self.using = using
+        self.stopped = False
+
+    def get_queryset(self):
+        from payment.models import Transaction
+        return Transaction.objects.using(self.using)
+
+    def claim(self):
+        with db_transaction.atomic(using=self.using):
+            ids = list(
+                self.get_queryset().select_for_update(skip_locked=True)
+                .pending().filter(next_verify__lte=now())
+                .order_by('next_verify')
+                .values_list('pk', flat=True)[:self.batch_size]
+            )
+            if ids:
+                self.get_queryset().filter(pk__in=ids).update(next_verify=now() + self.lease)
+        return ids
+
+    def verify(self, transaction):
+        """
+        Return True when transaction verified
+        """
+        try:
+            transaction.verify(send_signals=False)
+        except Exception as e:
+            logger.warning("Verify of transaction %s failed: %s", transaction.pk, e, exc_info=True)
+            # Expired transactions are not scheduled again
+            transaction.verify_attempts += 1
+            transaction.backend_controller.schedule_next_verify()
+            self.get_queryset().filter(pk=transaction.pk).update(
+                verify_attempts=F('verify_attempts') + 1,
+                next_verify=transaction.next_verify,
+            )
+            return False
+        return True
+
+    def run_once(self):
+        """
+        Verify one batch of due transactions and return number of them
+        pre_verify_batch and post_verify_batch are sent once for the batch instead of signals of each verify
+        """
+        ids = self.claim()
+        if not ids:
+            return 0
+        interval = 1 / self.rate
+        with buffer_events():
+            transactions = list(self.get_queryset().select_related('portal').with_cold_fields().filter(pk__in=ids))
+            signals.pre_verify_batch.send_by_backend(transactions)
+            verified = []
+            transitions = []
+            for transaction in transactions:
+                if self.stopped:
+                    break
+                started = time.monotonic()
+                previous = transaction.status
+                if self.verify(transaction):
+                    verified.append(transaction)
+                    transitions.append((previous, transaction.status))
+                elapsed = time.monotonic() - started
+                if elapsed < interval:
+                    time.sleep(interval - elapsed)
+            signals.post_verify_batch.send_by_backend(verified, transitions)
+        return len(ids)
+
+    def run(self):
+        idle_sleep = get_setting('VERIFY_WORKER_IDLE_SLEEP')
+        while not self.stopped:
+            if not self.run_once():
+                time.sleep(idle_sleep)
+
+    def stop(self, *args):
+        self.stopped = True
@@ -0,0 +1,194 @@
+import heapq
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction as db_transaction
+from django.db.models import F, Max
+
+from payment.conf import get_setting
+
+__all__ = ['is_sharded', 'get_shards', 'get_transaction_databases', 'shard_for_key', 'shard_for_id', 'get_shard',
+           'allocate_id', 'run_on_shards', 'MergedShards', 'ShardRouter']
+
+# Transactions sharded across PAYMENT_SHARDS databases by PAYMENT_SHARD_KEY ('user' or 'portal').
+# Order IDs interleave between shards (id % number of shards is index of shard), So an order ID always knows its
+# shard and IDs never collide. Gateway transaction IDs are mapped to order IDs by TransactionDirectory.
+# Refunds are kept on shard of their transaction.
+# PayPortal and RefundBatch rows are copied to every shard and users must be available on every shard too.
+
+
+def get_shards():
+    return list(get_setting('SHARDS'))
+
+
+def is_sharded():
+    return bool(get_setting('SHARDS'))
+
+
+def get_transaction_databases(database=None):
+    """
+    Databases that a management command works on, Given database or every shard
+    """
+    if database:
+        return [database]
+    if is_sharded():
+        return get_shards()
+    return [DEFAULT_DB_ALIAS]
+
+
+def shard_for_key(value):
+    shards = get_shards()
+    if value is None:
+        return shards[0]
+    if isinstance(value, int):
+        return shards[value % len(shards)]
+    return shards[zlib.crc32(str(value).encode()) % len(shards)]
+
+
+def shard_for_id(pk):
+    shards = get_shards()
+    return shards[int(pk) % len(shards)]
+
+
+def get_shard(transaction):
+    """
+    Shard of a transaction, Saved transactions stay on shard of their order ID
+    """
+    if transaction.pk is not None:
+        return shard_for_id(transaction.pk)
+    if get_setting('SHARD_KEY') == 'portal':
+        return shard_for_key(transaction.portal_id)
+    return shard_for_key(transaction.user_id)
+
+
+def allocate_id(shard):
+    """
+    Return next unused order ID of shard, IDs of shard at index i are i, i + n, i + 2n, ...
+    IDs are allocated by a conditional UPDATE of ShardSequence of shard, So processes never allocate same ID
+    """
+    from payment.models import ShardSequence
+
+    shards = get_shards()
+    queryset = ShardSequence.objects.using(shard).filter(pk=shard)
+    with db_transaction.atomic(using=shard):
+        if not queryset.update(last_id=F('last_id') + len(shards)):
+            _create_sequence(shard, shards.index(shard), len(shards))
+        return queryset.values_list('last_id', flat=True).get()
+
+
+def _create_sequence(shard, index, count):
+    """
+    Start sequence of shard at its first ID after existing transactions (first allocation on shard)
+    """
+    from payment.models import ShardSequence, Transaction
+
+    candidate = (Transaction.objects.using(shard).aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+    candidate += (index - candidate) % count
+    try:
+        with db_transaction.atomic(using=shard):
+            ShardSequence.objects.using(shard).create(shard=shard, last_id=candidate)
+    except IntegrityError:
+        # Created by a concurrent allocation
+        ShardSequence.objects.using(shard).filter(pk=shard).update(last_id=F('last_id') + count)
+
+
+def run_on_shards(function, shards=None):
+    """
+    Call function(shard) for each shard in parallel and return {shard: result}
+    """
+    shards = shards or get_shards()
+
+    def run(shard):
+        try:
+            return function(shard)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='payment-shard') as executor:
+        return dict(zip(shards, executor.map(run, shards)))
+
+
+class MergedShards:
+    """
+    Rows of queryset on every shard as one sequence ordered by descending order ID, For paginating
+    Slicing reads only rows up to end of slice from each shard
+    """
+
+    def __init__(self, queryset, shards=None):
+        self.queryset = queryset.order_by('-pk')
+        self.shards = shards
+
+    def count(self):
+        return sum(run_on_shards(lambda shard: self.queryset.using(shard).count(), self.shards).values())
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        if (item.start or 0) < 0 or (item.stop or 0) < 0 or item.step:
+            raise ValueError("Negative indexing and steps are not supported")
+        rows = run_on_shards(lambda shard: list(self.queryset.using(shard)[:item.stop]), self.shards)
+        merged = heapq.merge(*rows.values(), key=lambda obj: obj.pk, reverse=True)
+        return list(itertools.islice(merged, item.start, item.stop))
+
+
+class ShardRouter:
+    """
+    Database router of sharded transactions, Add 'payment.sharding.ShardRouter' to settings.DATABASE_ROUTERS before
+    other routers. Without an instance hint (e.g. ``Transaction.objects.filter()``) select shard by ``.using()``
+    """
+    sharded_models = {'transaction', 'transactionevent', 'transactiondetail', 'refund'}
+
+    def _get_shard(self, model, hints):
+        if not is_sharded():
+            return None
+        if model._meta.app_label != 'payment':
+            return None
+        if model._meta.model_name == 'transactiondirectory':
+            return get_setting('DIRECTORY_DATABASE')
+        instance = hints.get('instance')
+        # Instance hint may be related object (e.g. user of transaction)
+        if model._meta.model_name not in self.sharded_models or not isinstance(instance, model):
+            return None
+        if model._meta.model_name == 'transaction':
+            return get_shard(instance)
+        return shard_for_id(instance.transaction_id)
+
+    def db_for_read(self, model, **hints):
+        return self._get_shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._get_shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded() and obj1._state.db in get_shards() and obj2._state.db in get_shards():
+            return obj1._state.db == obj2._state.db or None
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_sharded() or app_label != 'payment':
+            return None
+        if model_name == 'transactiondirectory':
+            return db == get_setting('DIRECTORY_DATABASE')
+        return db in get_shards() or None
+
+
+def replicate_row(sender, instance, raw=False, using=None, **kwargs):
+    """
+    Copy saved row that every shard needs (PayPortal, RefundBatch) to every other shard (Receiver of post_save)
+    """
+    if raw or not is_sharded():
+        return
+    values = {field.attname: getattr(instance, field.attname) for field in sender._meta.concrete_fields}
+    for shard in get_shards():
+        if shard == using:
+            continue
+        queryset = sender._default_manager.using(shard)
+        if not queryset.filter(pk=instance.pk).update(**values):
+            queryset.bulk_create([sender(**values)], ignore_conflicts=True)
@@ -1,14 +1,108 @@
-from django.dispatch import Signal
+from django import dispatch
 
 from payment import globals
+from payment.profiling import get_profile
 
-pre_create_transaction = Signal()
-post_create_transaction = Signal()
-create_transaction_failed = Signal()
-pre_verify_transaction = Signal()
-post_verify_transaction = Signal()
-pre_refund_transaction = Signal()
-post_refund_transaction = Signal()
+
+class Signal(dispatch.Signal):
+    """
+    Signal that times its dispatch when current request or call is profiled (payment.profiling)
+    Durations of each receiver are in cProfile stats of profile
+
+    ``batched`` holds receivers whose work a receiver of a BatchSignal does for whole chunks (e.g.
+    update_summary_on_transition), They are called by send but not by fan-out of chunks (send_unbatched)
+    """
+
+    def __init__(self, name=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.batched = dispatch.Signal()
+
+    def has_listeners(self, sender=None):
+        return self.has_unbatched_listeners(sender) or self.batched.has_listeners(sender)
+
+    def has_unbatched_listeners(self, sender=None):
+        return super().has_listeners(sender)
+
+    def send(self, sender, **named):
+        return self._send(sender, named, batched=True)
+
+    def send_unbatched(self, sender, **named):
+        """
+        Send to receivers that are not in ``batched``
+        """
+        return self._send(sender, named, batched=False)
+
+    def _send(self, sender, named, batched):
+        profile = get_profile()
+        if profile is None or not self.has_listeners(sender):
+            return self._dispatch(sender, named, batched)
+        with profile.timer('signal', self.name):
+            return self._dispatch(sender, named, batched)
+
+    def _dispatch(self, sender, named, batched):
+        responses = super().send(sender, **named)
+        if batched:
+            responses += self.batched.send(sender, **named)
+        return responses
+
+
+class BatchSignal(Signal):
+    """
+    Signal of a chunk of transactions that bulk operations send once instead of ``item_signal`` per transaction
+    Receivers get ``transactions`` and ``transitions`` ((previous status, status) of each transaction, previous is None
+    when unknown)
+
+    item_signal is still sent for each transaction of chunk to its receivers, Except ``item_signal.batched`` ones that
+    receivers of batch do their work for. Nothing dispatched when there is no receiver.
+    """
+
+    def __init__(self, item_signal, name=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.item_signal = item_signal
+
+    def send_batch(self, sender, transactions, transitions=None, item_kwargs=None):
+        """
+        Send batch once, Then item_signal for each transaction with ``item_kwargs`` when it has unbatched receivers
+        """
+        if not transactions:
+            return []
+        responses = []
+        if self.has_listeners(sender):
+            responses = self.send(sender, transactions=transactions, transitions=transitions)
+        if self.item_signal.has_unbatched_listeners(sender):
+            for transaction in transactions:
+                self.item_signal.send_unbatched(sender, transaction=transaction, **(item_kwargs or {}))
+        return responses
+
+    def send_by_backend(self, transactions, transitions=None, item_kwargs=None):
+        """
+        Send batch once per backend of transactions, Sender is backend class like item signals of backends
+        """
+        groups = {}
+        for index, transaction in enumerate(transactions):
+            groups.setdefault(transaction.portal.get_backend(), []).append(index)
+        for backend_class, indexes in groups.items():
+            self.send_batch(backend_class, [transactions[index] for index in indexes],
+                            [transitions[index] for index in indexes] if transitions is not None else None,
+                            item_kwargs)
+
+
+pre_create_transaction = Signal('pre_create_transaction')
+post_create_transaction = Signal('post_create_transaction')
+create_transaction_failed = Signal('create_transaction_failed')
+pre_verify_transaction = Signal('pre_verify_transaction')
+post_verify_transaction = Signal('post_verify_transaction')
+pre_refund_transaction = Signal('pre_refund_transaction')
+post_refund_transaction = Signal('post_refund_transaction')
+# Sent after status of a transaction written by payment.state_machine.transition (post_save is not sent)
+post_transition = Signal('post_transition')
+
+# Sent once per chunk by bulk operations (VerifyScheduler, RefundProcessor, bulk_transition)
+pre_verify_batch = BatchSignal(pre_verify_transaction, 'pre_verify_batch')
+post_verify_batch = BatchSignal(post_verify_transaction, 'post_verify_batch')
+post_refund_batch = BatchSignal(post_refund_transaction, 'post_refund_batch')
+post_transition_batch = BatchSignal(post_transition, 'post_transition_batch')
 
 
 def update_last_transaction_id(sender, instance, created, **kwargs):
@@ -0,0 +1,93 @@
+import logging
+
+from django.db import router
+from django.utils.timezone import now
+
+from payment import signals
+from payment.status import StatusChoices
+
+__all__ = ['PENDING_STATUSES', 'FINAL_STATUSES', 'REFUND_STATUSES', 'TRANSITIONS', 'PREDECESSORS',
+           'can_transition', 'transition', 'bulk_transition']
+
+logger = logging.getLogger(__name__)
+
+ALL_STATUSES = frozenset(StatusChoices)
+
+# Transactions in these statuses are still waiting for the pay portal and must be verified again
+PENDING_STATUSES = frozenset({
+    StatusChoices.WAIT_FOR_PAY,
+    StatusChoices.WAIT_FOR_BANK,
+})
+FINAL_STATUSES = ALL_STATUSES - PENDING_STATUSES
+REFUND_STATUSES = frozenset({
+    StatusChoices.REFUNDED,
+    StatusChoices.REFUND_FAILED,
+    StatusChoices.REFUND_FAILED_BY_LACK_OF_FUNDS,
+})
+
+
+def _build_transitions():
+    transitions = {status: {status} for status in ALL_STATUSES}  # Repeating current status is always legal
+    transitions[StatusChoices.WAIT_FOR_PAY] |= ALL_STATUSES - REFUND_STATUSES
+    transitions[StatusChoices.WAIT_FOR_BANK] |= ALL_STATUSES - REFUND_STATUSES - {StatusChoices.WAIT_FOR_PAY}
+    transitions[StatusChoices.SUCCESSFUL] |= REFUND_STATUSES
+    transitions[StatusChoices.REFUND_FAILED] |= REFUND_STATUSES
+    transitions[StatusChoices.REFUND_FAILED_BY_LACK_OF_FUNDS] |= REFUND_STATUSES
+    return {status: frozenset(allowed) for status, allowed in transitions.items()}
+
+
+# status -> statuses that transaction can move to
+TRANSITIONS = _build_transitions()
+# status -> statuses that transaction can move from
+PREDECESSORS = {
+    status: frozenset(previous for previous, allowed in TRANSITIONS.items() if status in allowed)
+    for status in ALL_STATUSES
+}
+
+
+def can_transition(current, status):
+    return current is None or status in TRANSITIONS[current]
+
+
+def transition(transaction, status, update_fields=()):
+    """
+    Move saved transaction to status with a conditional ``UPDATE ... WHERE status IN (<predecessors>)``
+    and write update_fields of it in same query, So a late or concurrent response never overwrites a legal status
+
+    Return True when status written, Otherwise transaction reloaded from database and return False
+    """
+    model = type(transaction)
+    values = {name: getattr(transaction, name) for name in update_fields}
+    values['last_edit'] = now()
+    queryset = model._base_manager.using(transaction._state.db or router.db_for_write(model, instance=transaction))
+    queryset = queryset.filter(pk=transaction.pk)
+
+    changed = bool(queryset.filter(status__in=PREDECESSORS[status] - {status}).update(status=status, **values))
+    if not changed and not queryset.filter(status=status).update(**values):
+        transaction.refresh_from_db()
+        logger.info("Transition of transaction %s from %s to %s rejected", transaction.pk, transaction.status, status)
+        return False
+
+    transaction.status = status
+    transaction.last_edit = values['last_edit']
+    signals.post_transition.send(model, transaction=transaction, status=status, changed=changed)
+    return True
+
+
+def bulk_transition(queryset, status, **values):
+    """
+    Move every transaction of queryset that can move to status with one conditional UPDATE
+    Return moved transactions (loaded again with one query), post_transition_batch is sent once for them
+    """
+    previous = dict(queryset.values_list('pk', 'status'))
+    if not previous:
+        return []
+    last_edit = now()
+    base_queryset = queryset.model._base_manager.using(queryset.db).filter(pk__in=previous)
+    base_queryset.filter(status__in=PREDECESSORS[status] - {status}).update(status=status, last_edit=last_edit,
+                                                                             **values)
+    moved = list(base_queryset.filter(status=status, last_edit=last_edit))
+    signals.post_transition_batch.send_batch(queryset.model, moved,
+                                             [(previous[transaction.pk], status) for transaction in moved],
+                                             {'status': status, 'changed': True})
+    return moved
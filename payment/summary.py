@@ -0,0 +1,243 @@
+import logging
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from payment.models import Refund, RefundStatusChoices, Transaction, UserPaymentSummary
+from payment.sharding import is_sharded, run_on_shards
+from payment.state_machine import PENDING_STATUSES, PREDECESSORS
+from payment.status import StatusChoices
+
+__all__ = ['SUCCESSFUL_STATUSES', 'get_group', 'apply_change', 'apply_partial_refunds', 'rebuild_summaries']
+
+logger = logging.getLogger(__name__)
+
+# Paid transactions, Failed refund keeps transaction paid
+# Partial refunds of them move only their amount from total_paid to total_refunded
+SUCCESSFUL_STATUSES = frozenset({
+    StatusChoices.SUCCESSFUL,
+    StatusChoices.REFUND_FAILED,
+    StatusChoices.REFUND_FAILED_BY_LACK_OF_FUNDS,
+})
+
+# group -> (count field, amount field)
+GROUP_FIELDS = {
+    'successful': ('successful_count', 'total_paid'),
+    'refunded': ('refunded_count', 'total_refunded'),
+    'failed': ('failed_count', None),
+}
+
+
+def get_group(status):
+    """
+    Return group of summary that a transaction in status is counted in, None for pending statuses
+    """
+    if status in PENDING_STATUSES:
+        return None
+    if status in SUCCESSFUL_STATUSES:
+        return 'successful'
+    if status == StatusChoices.REFUNDED:
+        return 'refunded'
+    return 'failed'
+
+
+def _build_previous_groups():
+    previous_groups = {}
+    for status, predecessors in PREDECESSORS.items():
+        groups = {get_group(previous) for previous in predecessors - {status}}
+        if len(groups) > 1:
+            raise ValueError(f"Predecessors of {status!r} are in different summary groups")
+        previous_groups[status] = groups.pop() if groups else None
+    return previous_groups
+
+
+# status -> group that transaction leaves when it moves to status
+# State machine only lets statuses of one group move to each status, So a transition needs no read of old status
+PREVIOUS_GROUPS = _build_previous_groups()
+
+
+def add_change(deltas, previous, current, amount):
+    """
+    Add moving a transaction from previous group to current group to deltas of summary fields
+    """
+    for group, sign in ((previous, -1), (current, 1)):
+        if group is None:
+            continue
+        count_field, amount_field = GROUP_FIELDS[group]
+        deltas[count_field] = deltas.get(count_field, 0) + sign
+        if amount_field:
+            deltas[amount_field] = deltas.get(amount_field, 0) + sign * amount
+    return deltas
+
+
+def get_values(deltas, last_payment=None):
+    values = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if last_payment is not None:
+        paid_at, amount = last_payment
+        is_last = Q(last_payment_at__isnull=True) | Q(last_payment_at__lt=paid_at)
+        for name, value in (('last_payment_at', paid_at), ('last_payment_amount', amount)):
+            field = UserPaymentSummary._meta.get_field(name)
+            values[name] = Case(When(is_last, then=Value(value, output_field=field)), default=F(name),
+                                output_field=field)
+    return values
+
+
+def apply_change(user_id, amount, previous, current, paid_at=None):
+    """
+    Move a transaction of user from previous group to current group of summary with one atomic UPDATE
+    Errors are logged and never break the payment flow, ``rebuild_payment_summaries`` fixes the summary
+    """
+    if user_id is None or previous == current:
+        return
+    last_payment = (paid_at, amount) if previous is None and current == 'successful' and paid_at is not None else None
+    apply_values(user_id, get_values(add_change({}, previous, current, amount), last_payment))
+
+
+def apply_partial_refunds(amounts):
+    """
+    Move refunded amounts of partial refunds from paid total to refunded total of users, amounts is {user_id: amount}
+    Counts are kept, Transaction stays in successful group until its whole amount is refunded
+    """
+    for user_id, amount in amounts.items():
+        if user_id is not None and amount:
+            apply_values(user_id, get_values({'total_paid': -amount, 'total_refunded': amount}))
+
+
+def apply_values(user_id, values):
+    if not values:
+        return
+    try:
+        _apply_values(user_id, values)
+    except Exception as e:
+        logger.warning("Updating payment summary of user %s failed: %s", user_id, e, exc_info=True)
+
+
+def _apply_values(user_id, values):
+    queryset = UserPaymentSummary.objects.filter(user_id=user_id)
+    if queryset.update(**values):
+        return
+    try:
+        with db_transaction.atomic(using=queryset.db):
+            UserPaymentSummary.objects.create(user_id=user_id)
+    except IntegrityError:
+        # Created by a concurrent change
+        pass
+    queryset.update(**values)
+
+
+def update_summary_on_transition(sender, transaction, status, changed, **kwargs):
+    """
+    Receiver of post_transition, Chunks of bulk_transition are applied by update_summary_on_transition_batch
+    """
+    if changed:
+        apply_change(transaction.user_id, transaction.amount, PREVIOUS_GROUPS[status], get_group(status),
+                     transaction.last_edit)
+
+
+def update_summary_on_transition_batch(sender, transactions, transitions, **kwargs):
+    """
+    Receiver of post_transition_batch, Changes of each user are summed and written with one UPDATE
+    """
+    changes = {}
+    for transaction, (_, status) in zip(transactions, transitions):
+        if transaction.user_id is None:
+            continue
+        previous, current = PREVIOUS_GROUPS[status], get_group(status)
+        if previous == current:
+            continue
+        deltas, last_payment = changes.get(transaction.user_id, ({}, None))
+        add_change(deltas, previous, current, transaction.amount)
+        if previous is None and current == 'successful' and (last_payment is None or
+                                                              transaction.last_edit > last_payment[0]):
+            last_payment = (transaction.last_edit, transaction.amount)
+        changes[transaction.user_id] = (deltas, last_payment)
+    for user_id, (deltas, last_payment) in changes.items():
+        apply_values(user_id, get_values(deltas, last_payment))
+
+
+def remember_status(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """
+    Receiver of pre_save of transactions, Read status that save of a saved transaction replaces
+    """
+    if raw or instance._state.adding or (update_fields is not None and 'status' not in update_fields):
+        return
+    instance._summary_previous_status = Transaction._base_manager.using(using).filter(pk=instance.pk).values_list(
+        'status', flat=True).first()
+
+
+def update_summary_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Receiver of post_save of transactions, Status changes written by transition() are applied by its own receiver
+    """
+    if raw:
+        return
+    if created:
+        apply_change(instance.user_id, instance.amount, None, get_group(instance.status), instance.last_edit)
+        return
+    previous = instance.__dict__.pop('_summary_previous_status', None)
+    if previous is not None and previous != instance.status:
+        apply_change(instance.user_id, instance.amount, get_group(previous), get_group(instance.status),
+                     instance.last_edit)
+
+
+def update_summary_on_delete(sender, instance, **kwargs):
+    apply_change(instance.user_id, instance.amount, get_group(instance.status), None)
+
+
+def _aggregate(user_ids, database=None):
+    queryset = Transaction.objects.filter(user_id__in=user_ids)
+    if database:
+        queryset = queryset.using(database)
+    # Successful partial refunds of transactions that are not refunded yet
+    partially_refunded = Refund.objects.using(queryset.db).filter(
+        transaction__user_id=OuterRef('user_id'), transaction__status__in=SUCCESSFUL_STATUSES,
+        status=RefundStatusChoices.SUCCESSFUL,
+    ).order_by().values('transaction__user_id').annotate(total=Sum('amount')).values('total')
+    successful = Q(status__in=SUCCESSFUL_STATUSES)
+    refunded = Q(status=StatusChoices.REFUNDED)
+    failed = ~Q(status__in=SUCCESSFUL_STATUSES | PENDING_STATUSES | {StatusChoices.REFUNDED})
+    last_payment = queryset.filter(user_id=OuterRef('user_id'), status=StatusChoices.SUCCESSFUL).order_by('-last_edit')
+    rows = list(queryset.order_by().values('user_id').annotate(
+        total_paid=Sum('amount', filter=successful, default=0),
+        successful_count=Count('pk', filter=successful),
+        total_refunded=Sum('amount', filter=refunded, default=0),
+        refunded_count=Count('pk', filter=refunded),
+        failed_count=Count('pk', filter=failed),
+        last_payment_at=Max('last_edit', filter=Q(status=StatusChoices.SUCCESSFUL)),
+        last_payment_amount=Subquery(last_payment.values('amount')[:1]),
+        partially_refunded=Coalesce(Subquery(partially_refunded), 0),
+    ))
+    for row in rows:
+        partially_refunded = row.pop('partially_refunded')
+        row['total_paid'] -= partially_refunded
+        row['total_refunded'] += partially_refunded
+    return rows
+
+
+def rebuild_summaries(user_ids):
+    """
+    Recompute summaries of users from their transactions, Return number of summaries written
+    """
+    user_ids = list(user_ids)
+    if is_sharded():
+        rows = [row for shard_rows in run_on_shards(lambda shard: _aggregate(user_ids, shard)).values()
+                for row in shard_rows]
+    else:
+        rows = _aggregate(user_ids)
+
+    summaries = {user_id: UserPaymentSummary(user_id=user_id) for user_id in user_ids}
+    for row in rows:
+        summary = summaries[row['user_id']]
+        for name in ('total_paid', 'successful_count', 'total_refunded', 'refunded_count', 'failed_count'):
+            setattr(summary, name, getattr(summary, name) + row[name])
+        if row['last_payment_at'] and (summary.last_payment_at is None or
+                                       row['last_payment_at'] > summary.last_payment_at):
+            summary.last_payment_at = row['last_payment_at']
+            summary.last_payment_amount = row['last_payment_amount']
+    UserPaymentSummary.objects.bulk_create(
+        summaries.values(), update_conflicts=True, unique_fields=['user'],
+        update_fields=['total_paid', 'successful_count', 'total_refunded', 'refunded_count', 'failed_count',
+                       'last_payment_at', 'last_payment_amount'],
+    )
+    return len(summaries)